@@ -0,0 +1,134 @@
+# system libs
+import os
+import sys
+import json
+import argparse
+import multiprocessing as mp
+from contextlib import redirect_stdout
+from typing import Dict, List
+
+# 3rd party lib
+import numpy as np
+
+# Local imports
+from game import derive_seeds, read_log
+from helper import check_win, get_valid_actions
+from players.ai import AIPlayer, MCTSNode, PROVEN_LOSS, PROVEN_WIN
+
+
+def read_positions(path: str) -> List[Dict]:
+    '''
+    Reads the positions of a file, in one of these formats:
+        - a board in the `initial_states` format: rows of space separated cell values
+        - several such boards separated by blank lines, each optionally preceded by a `# name` line
+        - a `game.py` log: the position before each logged move
+
+    # Returns
+    List[Dict]: name and board of every position, with the player to move when the file tells it
+    '''
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    base = os.path.basename(path)
+    if lines and lines[0].isdigit():
+        log = read_log(path)
+        board = log['board'].copy()
+        positions = []
+        for k, (player, move) in enumerate(log['actions']):
+            positions.append({'name': f'{base}:{k + 1}', 'board': board.copy(), 'player': player})
+            if move is not None:
+                board[move] = player
+        return positions
+
+    positions = []
+    name, rows = None, []
+    for line in lines + ['']:
+        if line.startswith('#'):
+            name = line[1:].strip()
+        elif line:
+            rows.append([int(value) for value in line.split()])
+        elif rows:
+            positions.append({'name': name or f'{base}:{len(positions) + 1}', 'board': np.array(rows, dtype=np.uint8)})
+            name, rows = None, []
+    return positions
+
+
+def player_to_move(board: np.array) -> int:
+    # Player 1 moves first, so it is to move whenever both have placed as many stones
+    return 1 if np.count_nonzero(board == 1) <= np.count_nonzero(board == 2) else 2
+
+
+def analyse_position(task: Dict) -> Dict:
+    '''
+    Searches one position with the `ai` agent's MCTS, in a worker process
+
+    # Parameters
+    `task (Dict)`: name, board, player (None to infer it), sims, time, seed and top (moves kept, None for all)
+
+    # Returns
+    Dict: name, player, best move, simulations, and the root's moves ranked by visits with their visits, win rate
+    for the player to move, heuristic score and proven value (1 won, -1 lost, 0 unknown)
+    '''
+    board, name = task['board'], task['name']
+    player = task['player'] or player_to_move(board)
+    report = {'name': name, 'player': player}
+    if not get_valid_actions(board):
+        return {**report, 'error': 'board is full'}
+    for move in zip(*np.nonzero((board == 1) | (board == 2))):
+        if check_win(board, move, int(board[move]))[0]:
+            return {**report, 'error': f'game is already won by player {int(board[move])}'}
+
+    agent = AIPlayer(player, [float('inf'), float('inf')])
+    agent.set_seed(derive_seeds(task['seed'])[player])
+    agent.set_simulation_limit(task['sims'])
+    root = MCTSNode(board.copy(), player, params=agent.params)
+    mcts = agent.new_search(root, player)
+    if task['time'] is not None:
+        mcts.time_limit = task['time']
+    if task['sims'] is None:
+        mcts.simulation_limit = float('inf')
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        best = mcts.search()
+
+    moves = []
+    for child in sorted(root.children, key=lambda child: -child.visits):
+        # A child's wins are counted for the player who moved into it, the player to move at the root
+        proven = 1 if child.proven == PROVEN_LOSS else -1 if child.proven == PROVEN_WIN else 0
+        moves.append({'move': [int(child.action[0]), int(child.action[1])], 'visits': child.visits,
+                      'win_rate': child.wins / child.visits if child.visits else None,
+                      'heuristic': float(root.heuristic_scores[child.action]), 'proven': proven})
+    return {**report, 'best': [int(best.action[0]), int(best.action[1])], 'simulations': root.visits,
+            'moves': moves[:task['top']]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='Position files: initial_states boards, multi-position files or game logs')
+    parser.add_argument('--sims',   type=int, default=None, help='Simulations per position (int), 2000 unless --time is given')
+    parser.add_argument('--time',   type=float, default=None, help='Search time per position in seconds (float)')
+    parser.add_argument('--player', type=int, default=None, choices=[1, 2], help='Player to move, inferred from the stone counts by default')
+    parser.add_argument('--top',    type=int, default=None, help='Moves reported per position, all by default (int)')
+    parser.add_argument('--seed',   type=int, default=0,    help='Seed of the searches (int)')
+    parser.add_argument('--parallel', type=int, default=None, help='Positions analysed at once, defaults to the number of cores (int)')
+    parser.add_argument('--out',    type=str, default=None, help='Write the JSON here instead of stdout')
+    args = parser.parse_args()
+
+    sims = args.sims if args.sims is not None or args.time is not None else 2000
+    tasks = []
+    for path in args.files:
+        for position in read_positions(path):
+            player = args.player or position.get('player')
+            tasks.append({'name': position['name'], 'board': position['board'], 'player': player, 'sims': sims,
+                          'time': args.time, 'seed': args.seed, 'top': args.top})
+
+    with mp.Pool(args.parallel or mp.cpu_count()) as pool:
+        results = []
+        for result in pool.imap(analyse_position, tasks):
+            results.append(result)
+            print(f'{len(results)}/{len(tasks)} {result["name"]}', file=sys.stderr, flush=True)
+
+    output = json.dumps(results, indent=1)
+    if args.out is None:
+        print(output)
+    else:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
@@ -0,0 +1,161 @@
+'''
+End to end MCTS throughput of players/ai.py: simulations per second of `MCTS.search` on fixed positions of every
+board size, with and without blocked cells, each case in a fresh interpreter under a fixed simulation count and
+seed. Time to first move counts from interpreter start (imports and table builds included) to the end of the
+first search. Every case runs --repeat times and reports the median of each metric. Cases more than --threshold
+worse than the pinned baseline of the same sims and seed are flagged. Runs without regressions are appended to a
+JSON history; --set_baseline records the run whatever it shows and pins it as the new baseline (the first run
+is pinned when there is none yet)
+
+    python benchmarks/mcts_throughput.py [--sims 1000] [--dims 4 6 8 10] [--repeat 3] [--set_baseline]
+'''
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One case in a fresh interpreter: searches its positions and prints a JSON line of measurements
+PROBE = '''
+import time
+start = time.perf_counter()
+import io, json, resource, contextlib
+import numpy as np
+from game import derive_seeds, get_random_board
+from helper import EmptyCellPool, check_win
+from players.ai import AIPlayer, MCTSNode
+
+def positions(dim, blocks, seed):
+    # The empty board, then the same board after a seeded random game is stopped at a third of the cells
+    board = get_random_board(dim, blocks, np.random.RandomState(seed))
+    yield board.copy()
+    rng = np.random.RandomState(seed + 1)
+    pool = EmptyCellPool(board)
+    player = 1
+    for _ in range(len(pool) // 3):
+        while True:
+            move = pool.sample(rng)
+            board[move] = player
+            if not check_win(board, move, player)[0]:
+                break
+            board[move] = 0
+        pool.remove(move)
+        player = 3 - player
+    yield board
+
+first_move = None
+sims = seconds = 0
+for board in positions({dim}, {blocks}, {seed}):
+    agent = AIPlayer(1, [float('inf')] * 2)
+    agent.set_seed(derive_seeds({seed})[1])
+    agent.set_simulation_limit({sims})
+    player = 1 if np.count_nonzero(board == 1) <= np.count_nonzero(board == 2) else 2
+    search_start = time.perf_counter()
+    root = MCTSNode(board, player, params=agent.params)
+    mcts = agent.new_search(root, player)
+    with contextlib.redirect_stdout(io.StringIO()):
+        mcts.search()
+    now = time.perf_counter()
+    if first_move is None:
+        first_move = now - start
+    sims += mcts.total_simulations
+    seconds += now - search_start
+print(json.dumps({{'sims_per_sec': sims / seconds, 'first_move_seconds': first_move,
+                   'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+'''
+
+# Higher is better for sims_per_sec, lower for the others
+METRICS = {'sims_per_sec': 1, 'first_move_seconds': -1, 'peak_rss_kb': -1}
+
+
+def measure(dim: int, blocks: int, sims: int, seed: int):
+    code = PROBE.format(dim=dim, blocks=blocks, sims=sims, seed=seed)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def measure_median(dim: int, blocks: int, sims: int, seed: int, repeat: int):
+    # One run is at the mercy of the machine's load, the median of several is not
+    runs = [measure(dim, blocks, sims, seed) for _ in range(repeat)]
+    return {metric: statistics.median(run[metric] for run in runs) for metric in METRICS}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(results, baseline, threshold: float):
+    # (case, metric, baseline value, new value) of every metric worse than the baseline by more than threshold
+    found = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        for metric, direction in METRICS.items():
+            old, new = baseline[case][metric], result[metric]
+            if direction * (new - old) < -threshold * old:
+                found.append((case, metric, old, new))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sims', type=int, default=1000, help='Simulations per search (int)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the positions and searches (int)')
+    parser.add_argument('--dims', type=int, nargs='+', default=[4, 6, 8, 10], help='Board sizes (int)')
+    parser.add_argument('--history', type=str, default=os.path.join(ROOT, 'benchmarks', 'mcts_history.json'),
+                        help='JSON history the run is compared with and appended to')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change flagged as a regression (float)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every case, the median is kept (int)')
+    parser.add_argument('--set_baseline', action='store_true', help='Record the run even with regressions and compare later runs with it')
+    parser.add_argument('--no_record', action='store_true', help='Compare with the history without appending to it')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for dim in args.dims:
+        # Blocked boards get as many blocks as the board has layers
+        for blocks in (0, dim):
+            results[f'dim {dim}, {blocks} blocks'] = measure_median(dim, blocks, args.sims, args.seed, args.repeat)
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    pinned = [run for run in history if run['sims'] == args.sims and run['seed'] == args.seed and run.get('baseline')]
+    baseline = pinned[-1] if pinned else None
+    found = regressions(results, baseline['results'], args.threshold) if baseline else []
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for case, result in results.items():
+            print(f"{case:<18} {result['sims_per_sec']:9.0f} sims/s  {result['first_move_seconds']:7.2f} s to first move"
+                  f"  {result['peak_rss_kb'] / 1024:7.1f} MB")
+    if baseline:
+        print(f"compared with {baseline['commit']} of {baseline['date']}: "
+              f"{len(found)} regression{'s' if len(found) != 1 else ''} beyond {args.threshold:.0%}", file=sys.stderr)
+        for case, metric, old, new in found:
+            print(f'  REGRESSION {case}: {metric} {old:.4g} -> {new:.4g}', file=sys.stderr)
+
+    pin = args.set_baseline or baseline is None
+    if found and not pin and not args.no_record:
+        # A regressed run is kept out of the history, rerunning it must flag the regression again
+        print('not recorded, rerun with --set_baseline to accept these numbers', file=sys.stderr)
+    elif not args.no_record:
+        history.append({'date': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+                        'sims': args.sims, 'seed': args.seed, 'repeat': args.repeat, 'baseline': pin,
+                        'results': results})
+        with open(args.history, 'w') as f:
+            json.dump(history, f, indent=1)
+        if pin:
+            print('recorded as the baseline', file=sys.stderr)
+    sys.exit(1 if found and not args.set_baseline else 0)
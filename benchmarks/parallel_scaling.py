@@ -0,0 +1,82 @@
+'''
+Scaling of leaf-parallel MCTS in players/ai.py: simulations per second of a time bounded `MCTS.search` on an
+empty board, in this process (0 workers) and on a `PlayoutPool` of each --workers count. Each case runs in a
+fresh interpreter, so no case starts with the win cache or tables another one filled, and keeps the median of
+--repeat runs. Speedup is against 1 worker and efficiency is speedup per worker; near-linear scaling keeps
+efficiency close to 1. Worker counts above the number of cores are marked, they cannot scale
+
+    python benchmarks/parallel_scaling.py [--dim 10] [--workers 1 2 4 8] [--seconds 10] [--repeat 3]
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One search in a fresh interpreter, prints the completed simulations per second
+PROBE = '''
+import io, time, contextlib
+from game import derive_seeds, get_random_board, prebuild_tables
+from playout import PlayoutPool
+from players.ai import AIPlayer, MCTSNode
+
+board = get_random_board({dim}, 0)
+prebuild_tables(board.shape[0])
+agent = AIPlayer(1, [float('inf')] * 2)
+agent.set_seed(derive_seeds({seed})[1])
+root = MCTSNode(board, 1, params=agent.params)
+mcts = agent.new_search(root, 1)
+mcts.time_limit = {seconds}
+mcts.simulation_limit = float('inf')
+pool = PlayoutPool({workers}, seed={seed}) if {workers} > 0 else None
+mcts.workers = pool
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    mcts.search()
+elapsed = time.perf_counter() - start
+if pool is not None:
+    pool.close()
+print(root.visits / elapsed)
+'''
+
+
+def measure(dim: int, workers: int, seconds: float, seed: int, repeat: int) -> float:
+    code = PROBE.format(dim=dim, workers=workers, seconds=seconds, seed=seed)
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True, capture_output=True,
+                                text=True).stdout
+        runs.append(float(output.split()[-1]))
+    return median(runs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=10, help='Board size (int)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Playout process counts (int)')
+    parser.add_argument('--seconds', type=float, default=10, help='Search time of every run (float)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every case, the median is kept (int)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the searches (int)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    cores = os.cpu_count()
+    results = {0: measure(args.dim, 0, args.seconds, args.seed, args.repeat)}
+    for workers in sorted(set(args.workers)):
+        results[workers] = measure(args.dim, workers, args.seconds, args.seed, args.repeat)
+    # Speedups are relative to 1 worker, or to the serial search when 1 worker was not measured
+    base = results.get(1, results[0])
+
+    if args.json:
+        print(json.dumps({'dim': args.dim, 'cores': cores, 'sims_per_sec': results}, indent=2))
+    else:
+        print(f'dim {args.dim}, {cores} cores, {args.seconds:g} s searches, median of {args.repeat}')
+        for workers, rate in results.items():
+            speedup = rate / base
+            efficiency = f'{speedup / workers:6.2f}' if workers else '     -'
+            note = '  (more workers than cores)' if workers > cores else ''
+            print(f'{workers:3d} workers {rate:9.0f} sims/s  speedup {speedup:5.2f}  efficiency {efficiency}{note}')
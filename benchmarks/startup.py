@@ -0,0 +1,61 @@
+'''
+Startup cost of game.py: time and peak memory of a fresh interpreter that imports the game module and makes
+the players of a match, against the eager imports game.py used to do (tkinter and every player module)
+
+    python benchmarks/startup.py [--runs 10] [--json]
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code timed in a fresh interpreter; reports seconds spent and peak RSS in KB
+PROBE = '''
+import time, resource
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+SCENARIOS = {
+    'eager imports': 'import game, tkinter, players.ai, players.ai2, players.random, players.human',
+    'import game': 'import game',
+    'random vs random': 'import game; game.make_player("random", 1); game.make_player("random", 2)',
+    'ai vs random': 'import game; game.make_player("ai", 1); game.make_player("random", 2)',
+}
+
+
+def measure(body: str, runs: int):
+    times, memory = [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(body=body)], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout.split()
+        times.append(float(output[-2]))
+        memory.append(int(output[-1]))
+    return median(times), median(memory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help='Interpreters started per scenario (int)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for name, body in SCENARIOS.items():
+        seconds, rss = measure(body, args.runs)
+        results[name] = {'seconds': seconds, 'peak_rss_kb': rss}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        baseline = results['eager imports']['seconds']
+        for name, result in results.items():
+            print(f"{name:<18} {result['seconds'] * 1000:8.1f} ms  {result['peak_rss_kb'] / 1024:7.1f} MB  "
+                  f"{baseline / result['seconds']:5.2f}x")
@@ -0,0 +1,243 @@
+# system libs
+import sys
+import time
+import socket
+import argparse
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, TextIO, Tuple
+
+# 3rd party lib
+import numpy as np
+
+# Local imports
+from helper import check_win, get_valid_actions
+from game import configure_player, derive_seeds, make_player, get_random_board, PLAYER_CLASSES
+
+
+class EngineError(Exception):
+    pass
+
+
+class Engine:
+    '''
+    Line based, GTP style text protocol around one of the agents in `players/`
+
+    Every command is answered with `= <result>` or `? <error>` followed by an empty line, prefixed by the
+    command's id if it had one (`12 genmove 1` -> `=12 4,5`). Moves are written as `row,col`.
+
+        boardsize <layers>          start a new game on an empty board with the given number of layers
+        setup <values>              start a new game from a board, its (2 * layers - 1) ** 2 cell values in row order
+        clear_board                 start a new game on the current layout, without the stones
+        play <player> <row,col>     place a stone for player 1 or 2
+        genmove <player>            let the agent play for player 1 or 2, and place its stone
+        time_left <player> <secs>   set the remaining time of a player
+        seed <n>                    seed the players of the following games, as `game.py --seed n` would
+        showboard                   print the board
+        name, list_commands, quit
+
+    The process (and with it every module level table and cache of the agents) lives across games; only the
+    player objects are created anew for each game. Whatever the agents print goes to stderr.
+    '''
+
+    def __init__(self, player_name: str, time: float = 240, win_cache: int = None,
+                 playout_weights: Dict[str, float] = None):
+        '''
+        # Parameters
+        `player_name (str)`: Agent to wrap, one of the names accepted by `make_player`
+        `time (float)`: Time budget of each player in seconds, until changed by `time_left`
+        `win_cache (int)`: Entries of the agent's terminal check cache, None keeps its default size
+        `playout_weights (Dict[str, float])`: Pattern probabilities of the agent's playouts, None keeps the defaults
+        '''
+        self.player_name = player_name
+        self.time = time
+        self.win_cache = win_cache
+        self.playout_weights = playout_weights
+        self.commands: Dict[str, Callable[[List[str]], str]] = {
+            'boardsize': self.boardsize,
+            'setup': self.setup,
+            'clear_board': self.clear_board,
+            'play': self.play,
+            'genmove': self.genmove,
+            'time_left': self.time_left,
+            'seed': self.set_seed,
+            'showboard': self.showboard,
+            'name': lambda args: player_name,
+            'list_commands': lambda args: '\n'.join(self.commands),
+            'quit': lambda args: '',
+        }
+        self.seed = None
+        self.layout = None
+        self.board = None
+        self.new_game(get_random_board(4, 0))
+
+    def new_game(self, board: np.array):
+        self.layout = np.where(board == 3, 3, 0).astype(board.dtype)
+        self.board = board.copy()
+        self.timer = [self.time, self.time]
+        self.players = {}
+        self.last_move = None  # (move, player) of the last stone placed
+        self.winner = None
+
+    def handle(self, line: str) -> Tuple[str, bool]:
+        '''
+        Runs one command line
+
+        # Returns
+        Tuple[str, bool]: The response, including its trailing empty line, and whether the session is over
+        '''
+        words = line.split()
+        command_id = ''
+        if words and words[0].isdigit():
+            command_id = words.pop(0)
+        if not words:
+            return '', False
+        command, args = words[0], words[1:]
+        if command not in self.commands:
+            return f'?{command_id} unknown command\n\n', False
+        try:
+            result = self.commands[command](args)
+        except EngineError as error:
+            return f'?{command_id} {error}\n\n', False
+        except Exception as error:
+            # A failing agent costs its move, not the engine that stays warm across games
+            return f'?{command_id} {type(error).__name__}: {error}\n\n', False
+        return f'={command_id} {result}'.rstrip(' ') + '\n\n', command == 'quit'
+
+    def serve(self, infile: TextIO, outfile: TextIO):
+        for line in infile:
+            response, done = self.handle(line.split('#', 1)[0])
+            outfile.write(response)
+            outfile.flush()
+            if done:
+                break
+
+    def parse_player(self, word: str) -> int:
+        if word not in ('1', '2'):
+            raise EngineError('player must be 1 or 2')
+        return int(word)
+
+    def parse_move(self, words: List[str]) -> Tuple[int, int]:
+        try:
+            i, j = (int(value) for value in ' '.join(words).replace(',', ' ').split())
+        except ValueError:
+            raise EngineError('move must be row,col')
+        if not (0 <= i < self.board.shape[0] and 0 <= j < self.board.shape[1]) or self.board[i, j] != 0:
+            raise EngineError('illegal move')
+        return i, j
+
+    def boardsize(self, args: List[str]) -> str:
+        if len(args) != 1 or not args[0].isdigit() or int(args[0]) < 2:
+            raise EngineError('boardsize takes a number of layers, at least 2')
+        self.new_game(get_random_board(int(args[0]), 0))
+        return ''
+
+    def setup(self, args: List[str]) -> str:
+        size = int(round(len(args) ** 0.5))
+        if size * size != len(args) or size % 2 == 0 or any(value not in ('0', '1', '2', '3') for value in args):
+            raise EngineError('setup takes the (2 * layers - 1) ** 2 cell values of the board')
+        self.new_game(np.array(args, dtype=np.uint8).reshape(size, size))
+        return ''
+
+    def clear_board(self, args: List[str]) -> str:
+        self.new_game(self.layout)
+        return ''
+
+    def play(self, args: List[str]) -> str:
+        if len(args) < 2:
+            raise EngineError('play takes a player and a move')
+        player = self.parse_player(args[0])
+        move = self.parse_move(args[1:])
+        self.place(move, player)
+        return ''
+
+    def genmove(self, args: List[str]) -> str:
+        if len(args) != 1:
+            raise EngineError('genmove takes a player')
+        player_number = self.parse_player(args[0])
+        if self.winner is not None:
+            raise EngineError('game is over')
+        if not get_valid_actions(self.board):
+            raise EngineError('board is full')
+        if player_number not in self.players:
+            self.players[player_number] = make_player(self.player_name, player_number, self.timer)
+            if self.seed is not None:
+                configure_player(self.players[player_number], derive_seeds(self.seed)[player_number])
+            if self.win_cache is not None and hasattr(self.players[player_number], 'set_win_cache'):
+                self.players[player_number].set_win_cache(self.win_cache)
+            if self.playout_weights is not None and hasattr(self.players[player_number], 'set_playout_weights'):
+                self.players[player_number].set_playout_weights(self.playout_weights)
+        player = self.players[player_number]
+        last_move = self.last_move
+        player.last_opponent_move = last_move[0] if last_move is not None and last_move[1] != player_number else None
+
+        start = time.time()
+        with redirect_stdout(sys.stderr):
+            move = player.get_move(self.board.copy())
+        self.timer[player_number - 1] -= time.time() - start
+        try:
+            row, col = move
+            move = self.parse_move([str(int(row)), str(int(col))])
+        except (TypeError, ValueError):
+            raise EngineError(f'agent returned {move!r}, not a move')
+        self.place(move, player_number)
+        return f'{move[0]},{move[1]}'
+
+    def place(self, move: Tuple[int, int], player: int):
+        self.board[move] = player
+        self.last_move = (move, player)
+        if self.winner is None and check_win(self.board, move, player)[0]:
+            self.winner = player
+
+    def time_left(self, args: List[str]) -> str:
+        if len(args) < 2:
+            raise EngineError('time_left takes a player and a number of seconds')
+        player = self.parse_player(args[0])
+        try:
+            self.timer[player - 1] = float(args[1])
+        except ValueError:
+            raise EngineError('time must be a number of seconds')
+        return ''
+
+    def set_seed(self, args: List[str]) -> str:
+        if len(args) != 1 or not args[0].isdigit():
+            raise EngineError('seed takes a non-negative integer')
+        self.seed = int(args[0])
+        return ''
+
+    def showboard(self, args: List[str]) -> str:
+        rows = [' '.join(str(value) for value in row) for row in self.board]
+        return '\n' + '\n'.join(rows)
+
+
+def serve_socket(engine: Engine, port: int):
+    '''
+    Serves the protocol on a localhost TCP port, one connection at a time. `quit` ends the connection,
+    the engine keeps listening for the next one
+    '''
+    with socket.create_server(('127.0.0.1', port)) as server:
+        print(f'Engine listening on 127.0.0.1:{server.getsockname()[1]}', file=sys.stderr, flush=True)
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile('r') as infile, conn.makefile('w') as outfile:
+                engine.serve(infile, outfile)
+            engine.new_game(engine.layout)
+
+
+if __name__ == '__main__':
+    player_types = [name for name in PLAYER_CLASSES if name != 'human']
+    parser = argparse.ArgumentParser()
+    parser.add_argument('player', choices=player_types)
+    parser.add_argument('--time', type=float, default=240, help='Time budget for each player in seconds, until set by time_left (float)')
+    parser.add_argument('--port', type=int, default=None, help='Serve on this localhost TCP port instead of stdin / stdout (int)')
+    parser.add_argument('--win_cache', type=int, default=None, help='Entries of the agent\'s terminal check cache, about 220 bytes each, 2^18 by default (int)')
+    parser.add_argument('--playout_weights', type=str, default=None, help='JSON file of the agent\'s playout pattern probabilities (see playout.load_pattern_weights)')
+    args = parser.parse_args()
+    playout_weights = None
+    if args.playout_weights is not None:
+        from playout import load_pattern_weights
+        playout_weights = load_pattern_weights(args.playout_weights)
+    engine = Engine(args.player, args.time, args.win_cache, playout_weights)
+    if args.port is None:
+        engine.serve(sys.stdin, sys.stdout)
+    else:
+        serve_socket(engine, args.port)
@@ -1,55 +1,86 @@
 # system libs
 import os
+import sys
 import time
 import json
 import random
+import signal
 import argparse
+import importlib
 import multiprocessing as mp
 from datetime import datetime
-from multiprocessing import Value
+from contextlib import redirect_stdout
+from multiprocessing import Value, shared_memory
 
 from time import sleep
 from threading import Thread 
-from typing import Tuple, Callable, Dict
+from typing import List, Tuple, Callable, Dict
 
 # 3rd party lib
 import numpy as np
-import tkinter as tk
+# tkinter is imported only when the GUI is shown
 
 
 # Local imports
-from helper import get_valid_actions, check_win, HEXAGON_COORDS, CLICK_EVENT, PLAYER_TIME
+from helper import check_win, get_cell_tables, EmptyCellPool, HEXAGON_COORDS, INPUT_EVENTS, PLAYER_TIME
 
-# Import Players
-from players.ai import AIPlayer
-from players.ai2 import AIPlayer as AIPlayer2
-from players.random import RandomPlayer
-from players.human import HumanPlayer
+# Players: name -> (module, class), each module is imported the first time one of its players is made
+PLAYER_CLASSES = {
+    'ai': ('players.ai', 'AIPlayer'),
+    'ai2': ('players.ai2', 'AIPlayer'),
+    'random': ('players.random', 'RandomPlayer'),
+    'human': ('players.human', 'HumanPlayer'),
+}
 
 
 TimeLimitExceedAction = (1000, True)
 
+# Directory get_start_board reads start positions from
+INITIAL_STATES_DIR = os.path.join('havannah', 'initial_states')
+
 
 def turn_worker(state: np.array, send_end, p_func: Callable[[np.array], Tuple[int, bool]], PLAYER_TIME):
     send_end.send(p_func(state, PLAYER_TIME))
 
+def get_player_class(name):
+    module, cls = PLAYER_CLASSES[name]
+    return getattr(importlib.import_module(module), cls)
+
 def make_player(name, num, timer=PLAYER_TIME):
-    if name == 'ai':
-        return AIPlayer(num, timer)
-    elif name == 'ai2':
-        return AIPlayer2(num, timer)
-    elif name == 'random':
-        return RandomPlayer(num, timer)
-    elif name == 'human':
-        return HumanPlayer(num, timer)
+    return get_player_class(name)(num, timer)
+
+def derive_seeds(seed: int) -> Tuple[int, int, int]:
+    # Independent streams of a run: the board, then player 1 and player 2
+    return tuple(int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(3))
+
+def configure_player(player, seed: int = None, sims: int = 0):
+    if seed is not None and hasattr(player, 'set_seed'):
+        player.set_seed(seed)
+    if sims > 0 and hasattr(player, 'set_simulation_limit'):
+        player.set_simulation_limit(sims)
+
+def prebuild_tables(dim):
+    # Lookup tables of the board, built before forking so the player worker inherits them copy-on-write
+    from playout import get_bridge_table
+    from symmetry import get_zobrist_keys
+    get_cell_tables(dim)
+    get_zobrist_keys(dim)
+    get_bridge_table(dim)
 
 
 class Game:
-    def __init__(self, player1_name, player2_name, player1, player2, time: int, board_init: np.array, layers: int, mode: str):
+    def __init__(self, player1_name, player2_name, player1, player2, time: int, board_init: np.array, layers: int, mode: str, ponder: float = 0, workers: int = 0, tree_memory: float = 0, seed: int = None, sims: int = 0, win_cache: int = None, playout_weights: Dict[str, float] = None):
         """
         :param player1:
         :param player2:
         :param time: Time in milliseconds
+        :param ponder: CPU share AI players may use to search on the opponent's time, 0 disables pondering
+        :param workers: Playout processes per AI player for leaf-parallel search, 0 disables it
+        :param tree_memory: Memory budget in MB of each AI player's search tree, 0 leaves it unbounded
+        :param seed: Seed of the run, each player gets its own stream derived from it (see derive_seeds)
+        :param sims: Simulations per search of AI players instead of their time limit, 0 keeps the time limit
+        :param win_cache: Entries of the AI players' terminal check cache, None keeps its default size
+        :param playout_weights: Pattern probabilities of the AI players' playouts, None keeps the defaults
         :param m:
         :param n:
         :param popout_moves:
@@ -59,7 +90,13 @@ class Game:
         self.colors = ['', 'yellow', 'red', 'black']  # Extra white color added
         self.faded_colors = ['', 'light yellow', 'orange', 'gray']  # Extra white color added
         self.layers = layers
-        self.state = board_init
+        # The board lives in shared memory, the player worker maps the same block and only receives move deltas
+        self.shm = shared_memory.SharedMemory(create=True, size=board_init.nbytes)
+        self.state = np.ndarray(board_init.shape, dtype=board_init.dtype, buffer=self.shm.buf)
+        self.state[:] = board_init
+        self.pool = EmptyCellPool(self.state)
+        self.last_move = None  # (flat cell index, player number) of the last stone placed
+        self.move_seq = 0      # number of stones placed so far, sent along with every delta
         self.gui_board = []
         PLAYER_TIME[0] = time
         PLAYER_TIME[1] = time
@@ -73,9 +110,18 @@ class Game:
         self.game_over = Value('b', False)
         self.pause_timer = Value('b', True)
 
-        self.parent_conn, self.child_conn = mp.Pipe()
-        self.proc = mp.Process(target=self.player_workers, args=(make_player, self.game_over, self.child_conn, player1_name, player2_name, PLAYER_TIME))
-        self.proc.start()
+        player_seeds = derive_seeds(seed)[1:] if seed is not None else (None, None)
+        for player, player_seed in zip(self.players, player_seeds):
+            configure_player(player, player_seed, sims)
+
+        # Only AI players move from the player worker, the others are asked in this process
+        self.proc = None
+        if 'ai' in (player1.type, player2.type):
+            prebuild_tables(self.state.shape[0])
+            self.parent_conn, self.child_conn = mp.Pipe()
+            self.proc = mp.Process(target=self.player_workers, args=(make_player, self.game_over, self.child_conn, player1_name, player2_name, PLAYER_TIME,
+                                                                     self.shm.name, self.state.shape, self.state.dtype.str, ponder, workers, tree_memory, player_seeds, sims, win_cache, playout_weights))
+            self.proc.start()
 
         # Log: Writing initial state of the board to log file
         # Explain the log file
@@ -88,11 +134,17 @@ class Game:
             log_file.write(s)
             log_file.write("Player 1 Type: " + player1.type + '\n')
             log_file.write("Player 2 Type: " + player2.type + '\n')
+            # Everything replay_game needs to run the same searches again
+            log_file.write("Player 1 Agent: " + player1_name + '\n')
+            log_file.write("Player 2 Agent: " + player2_name + '\n')
+            log_file.write("Seed: " + str(seed) + '\n')
+            log_file.write("Simulations: " + str(sims) + '\n')
             print(s)
             print("Player 1 Type: " + player1.type)
             print("Player 2 Type: " + player2.type)
 
         if mode == "gui":
+            import tkinter as tk
             self.use_gui = True
             root = tk.Tk()
             root.title('Extended Havannah')
@@ -182,7 +234,8 @@ class Game:
     def on_click(self, event):
         current_player = self.players[self.current_turn.value]
         if current_player.type == 'human':
-            CLICK_EVENT[0] = event
+            polygon_id = event.widget.find_withtag("current")[0]  # Get the polygon ID
+            INPUT_EVENTS.put(HEXAGON_COORDS[polygon_id])
 
     @staticmethod
     def clock(game_over, pause_timer, current_turn, PLAYER_TIME):
@@ -212,7 +265,7 @@ class Game:
             sleep(0.01)
 
             if game_over.value:
-                if self.proc.is_alive():
+                if self.proc is not None and self.proc.is_alive():
                     self.proc.terminate()
 
                 with open('logs.txt', 'a') as log_file:
@@ -232,29 +285,84 @@ class Game:
                     log_file.write("Player 1 Time Remaining: " + str(PLAYER_TIME[0]) + ' s\n')
                     log_file.write("Player 2 Time Remaining: " + str(PLAYER_TIME[1]) + ' s\n')
                     print(s)
+                # Keep the final board readable once the shared block is gone
+                self.state = self.state.copy()
+                self.shm.close()
+                self.shm.unlink()
                 break
 
     @staticmethod
-    def player_workers(make_player, game_over, pipe_conn, player1, player2, timer):
+    def player_workers(make_player, game_over, pipe_conn, player1, player2, timer, shm_name, shape, dtype, ponder=0, workers=0, tree_memory=0, player_seeds=(None, None), sims=0, win_cache=None, playout_weights=None):
         players = [make_player(player1, 1, timer), make_player(player2, 2, timer)]
-
-        while not game_over.value:
-            current_turn, state = pipe_conn.recv()
-            move = players[current_turn].get_move(state)
-            pipe_conn.send(move)
+        for player, player_seed in zip(players, player_seeds):
+            configure_player(player, player_seed, sims)
+        if ponder > 0:
+            for player in players:
+                if hasattr(player, 'set_pondering'):
+                    player.set_pondering(ponder)
+        if workers > 0:
+            for player in players:
+                if hasattr(player, 'set_workers'):
+                    player.set_workers(workers)
+        if tree_memory > 0:
+            for player in players:
+                if hasattr(player, 'set_tree_budget'):
+                    player.set_tree_budget(memory_limit=int(tree_memory * 2 ** 20))
+        if win_cache is not None:
+            for player in players:
+                if hasattr(player, 'set_win_cache'):
+                    player.set_win_cache(win_cache)
+        if playout_weights is not None:
+            for player in players:
+                if hasattr(player, 'set_playout_weights'):
+                    player.set_playout_weights(playout_weights)
+        shm = shared_memory.SharedMemory(name=shm_name)
+        board = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        last_seq = 0
+        ponderer = None
+
+        def stop(signum, frame):
+            raise SystemExit(0)
+
+        # The game ends this worker with SIGTERM, unwind so the cleanup below still runs
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            while not game_over.value:
+                # Search on the opponent's time until the engine hands over the next turn
+                while ponderer is not None and not pipe_conn.poll(ponderer.ponder_idle_time()):
+                    if not ponderer.ponder():
+                        ponderer = None
+                current_turn, seq, last_move = pipe_conn.recv()
+                player = players[current_turn]
+                # Only a newer delta by the other player is that player's last opponent move
+                opponent_move = None
+                if last_move is not None and seq > last_seq and last_move[1] != player.player_number:
+                    opponent_move = divmod(last_move[0], shape[1])
+                last_seq = max(last_seq, seq)
+                player.last_opponent_move = opponent_move
+                move = player.get_move(board.copy())
+                pipe_conn.send(move)
+                ponderer = player if getattr(player, 'ponder_cpu_share', 0) > 0 else None
+        finally:
+            # Playout processes of the players would otherwise outlive the game
+            for player in players:
+                if hasattr(player, 'set_workers'):
+                    player.set_workers(0)
+            # The view must go before the handle can be closed
+            del board
+            shm.close()
 
     def make_move(self, game_over, pause_timer, current_turn):
         current_player = self.players[current_turn.value]
-        valid_actions = get_valid_actions(self.state, current_player.player_number)
 
-        if len(valid_actions) == 0:
+        if len(self.pool) == 0:
             game_over.value = True
 
         if not game_over.value:
             if current_player.type == 'ai':
                 try:
                     pause_timer.value = False
-                    self.parent_conn.send((current_turn.value, self.state))
+                    self.parent_conn.send((current_turn.value, self.move_seq, self.last_move))
                     if not self.parent_conn.poll(timeout=PLAYER_TIME[current_turn.value]):
                         game_over.value = True
                         self.winner = 2 - current_turn.value
@@ -282,7 +390,7 @@ class Game:
 
             if action == TimeLimitExceedAction:
                 log_action = {'player': current_player.player_number, 'move': 'TLE'}
-            elif action not in valid_actions:
+            elif action not in self.pool:
                 # Invalid move by the player. Don't do anything
                 log_action = {'player': current_player.player_number, 'move': str(action) + ' is invalid'}
             else:
@@ -313,6 +421,9 @@ class Game:
         row, col = cell
         if board[row, col] == 0:
             board[row, col] = player_num
+            self.pool.remove(cell)
+            self.last_move = (row * board.shape[1] + col, player_num)
+            self.move_seq += 1
             if self.use_gui:
                 self.c.itemconfig(self.gui_board[col][row], fill=self.colors[current_turn.value + 1])
                 hex_coords = self.calculate_hexagon(row, col, 25, self.scale)
@@ -323,26 +434,26 @@ class Game:
             raise Exception(err)
 
 
-def get_random_board(layers: int, blocks: int):
+def get_random_board(layers: int, blocks: int, rng=np.random):
     assert layers > 1
     board = np.zeros([2 * layers - 1, 2 * layers - 1]).astype(np.uint8)
     for i in range(layers, 2 * layers - 1, 1):
         for j in range(0, i - layers + 1, 1):
             board[i][j] = 3
             board[i][2 * layers - 2 - j] = 3
-    rand_x = np.random.randint(0, 2 * layers - 1, blocks)
+    rand_x = rng.randint(0, 2 * layers - 1, blocks)
     for x in rand_x:
         if x >= layers:
-            y = np.random.randint(x - layers + 1, 3 * layers - 2 - x)
+            y = rng.randint(x - layers + 1, 3 * layers - 2 - x)
         else:
-            y = np.random.randint(0, 2 * layers - 1)
+            y = rng.randint(0, 2 * layers - 1)
         board[x][y] = 3
     return board
 
 
 def get_start_board(file_pth: str) -> Tuple[int, np.array]:
     b = []
-    file_pth = os.path.join('havannah', 'initial_states', file_pth)
+    file_pth = os.path.join(INITIAL_STATES_DIR, file_pth)
     with open(file_pth) as f:
         for line in f:
             line = line.strip()
@@ -351,25 +462,176 @@ def get_start_board(file_pth: str) -> Tuple[int, np.array]:
     board = np.array(b, dtype=int)
     return board
 
-def main(player1: str, player2: str, time: int, dim: int, mode: str, init_file_name: str = None, blocks: int = 0):
-    random.seed(datetime.timestamp(datetime.now()))
+def play_game(player1: str, player2: str, board: np.array, time: float, quiet: bool = True, players: List = None,
+              on_move: Callable = None, seed: int = None) -> Dict:
+    """
+    Plays a whole game in this process, without GUI, clock process or log file. The players are asked for
+    their moves in turn, with the same rules as `Game`: running out of time loses, invalid moves pass the turn
+    :param player1: Name of player 1, a key of PLAYER_CLASSES
+    :param player2: Name of player 2
+    :param board: Initial board
+    :param time: Time budget of each player in seconds
+    :param quiet: Discard whatever the players print
+    :param players: Player objects to use instead of making player1 and player2, sharing the timer list given to them
+    :param on_move: Called as on_move(state, player_number, action, player) before each valid move is placed
+    :param seed: Seed of the game, each player gets its own stream derived from it (see derive_seeds)
+    :return: winner (1, 2, or 0 for a full board), structure formed, 'time' or 'error' (with the error) when a player
+        failed, moves played, time left of both players
+    """
+    if players is None:
+        timer = [time, time]
+        players = [make_player(player1, 1, timer), make_player(player2, 2, timer)]
+    else:
+        timer = players[0].timer
+        timer[:] = [time, time]
+    if seed is not None:
+        for player, player_seed in zip(players, derive_seeds(seed)[1:]):
+            configure_player(player, player_seed)
+    state = board.copy()
+    pool = EmptyCellPool(state)
+    result = {'winner': 0, 'structure': None, 'moves': [], 'time_left': timer}
+    turn = 0
+    last_move = None
+    with open(os.devnull, 'w') as devnull:
+        output = devnull if quiet else sys.stdout
+        while len(pool):
+            player = players[turn]
+            player.last_opponent_move = last_move
+            start = datetime.now()
+            try:
+                with redirect_stdout(output):
+                    action = player.get_move(state.copy())
+                action = int(action[0]), int(action[1])
+            except Exception as error:
+                # As in Game a failing player loses, the game is recorded instead of ending the caller's run
+                result.update(winner=2 - turn, structure='error', error=f'{type(error).__name__}: {error}')
+                break
+            timer[turn] -= (datetime.now() - start).total_seconds()
+            if timer[turn] < 0:
+                result.update(winner=2 - turn, structure='time')
+                break
+            last_move = None
+            if action in pool:
+                if on_move is not None:
+                    on_move(state, turn + 1, action, player)
+                pool.remove(action)
+                state[action] = turn + 1
+                result['moves'].append(action)
+                last_move = action
+                win, way = check_win(state, action, turn + 1)
+                if win:
+                    result.update(winner=turn + 1, structure=way)
+                    break
+            turn = 1 - turn
+    return result
+
+def read_log(log_path: str) -> Dict:
+    """
+    Reads a game log written by `Game`
+    :param log_path: Path of the log
+    :return: board, agents (names of both players, their types for logs without agent lines), seed (None if the log
+        has none), sims, and actions: the logged moves in order as (player, move), move being None when invalid or TLE
+    """
+    with open(log_path) as f:
+        lines = [line.rstrip('\n') for line in f]
+    layers = int(lines[0])
+    board = np.array([[int(value) for value in line.split()] for line in lines[1:2 * layers]], dtype=np.uint8)
+    fields = {}
+    actions = []
+    for line in lines[2 * layers:]:
+        if line.startswith('{'):
+            action = json.loads(line)
+            move = action['move']
+            actions.append((action['player'], tuple(move) if isinstance(move, list) else None))
+        elif ': ' in line:
+            key, value = line.split(': ', 1)
+            fields.setdefault(key, value)
+    agents = [fields.get(f'Player {k} Agent', fields.get(f'Player {k} Type')) for k in (1, 2)]
+    seed = fields.get('Seed', 'None')
+    return {'board': board, 'agents': agents, 'seed': None if seed == 'None' else int(seed),
+            'sims': int(fields.get('Simulations', 0)), 'actions': actions}
+
+def replay_game(log_path: str, sims: int = None, moves: int = None, quiet: bool = True) -> List[Dict]:
+    """
+    Re-executes a logged game move by move in this process. Before each logged move its player is asked for a
+    move again, with the logged seed and every search bounded by simulations, then the logged move is played
+    whatever the answer. Human players are not asked. Replays of a log are identical to each other, and match
+    the original game when it was played with --seed and --sims (without pondering or playout workers)
+    :param log_path: Path of the log
+    :param sims: Simulations per search, defaults to the logged --sims value (or 1000 if there is none)
+    :param moves: Replay only this many logged moves
+    :param quiet: Discard whatever the players print
+    :return: For each replayed move: player, logged move, replayed move and seconds the player took
+    """
+    log = read_log(log_path)
+    sims = sims or log['sims'] or 1000
+    timer = [float('inf'), float('inf')]
+    players = [make_player(log['agents'][0], 1, timer), make_player(log['agents'][1], 2, timer)]
+    player_seeds = derive_seeds(log['seed'])[1:] if log['seed'] is not None else (None, None)
+    for player, player_seed in zip(players, player_seeds):
+        configure_player(player, player_seed, sims)
+    state = log['board'].copy()
+    last_move = None  # (move, player number) of the last stone placed
+    records = []
+    with open(os.devnull, 'w') as devnull:
+        output = devnull if quiet else sys.stdout
+        for number, logged in log['actions'][:moves]:
+            player = players[number - 1]
+            replayed = None
+            start = time.time()
+            if player.type != 'human':
+                player.last_opponent_move = last_move[0] if last_move is not None and last_move[1] != number else None
+                with redirect_stdout(output):
+                    action = player.get_move(state.copy())
+                replayed = int(action[0]), int(action[1])
+            records.append({'player': number, 'logged': logged, 'replayed': replayed, 'seconds': time.time() - start})
+            if logged is not None:
+                state[logged] = number
+                last_move = (logged, number)
+    return records
+
+def main(player1: str, player2: str, time: int, dim: int, mode: str, init_file_name: str = None, blocks: int = 0, ponder: float = 0, workers: int = 0, tree_memory: float = 0, seed: int = None, sims: int = 0, win_cache: int = None, playout_weights: Dict[str, float] = None):
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(63)
+    random.seed(seed)
     if init_file_name is not None:
         board = get_start_board(init_file_name)
     else:
-        board = get_random_board(dim, blocks)
+        board = get_random_board(dim, blocks, np.random.RandomState(derive_seeds(seed)[0] % 2 ** 32))
     dim = (board.shape[0] + 1) // 2
-    Game(player1, player2, make_player(player1, 1), make_player(player2, 2), time, board, dim, mode)
+    Game(player1, player2, make_player(player1, 1), make_player(player2, 2), time, board, dim, mode, ponder, workers, tree_memory, seed, sims, win_cache, playout_weights)
 
 
 if __name__ == '__main__':
-    player_types = ['ai', 'ai2', 'random', 'human']
+    player_types = list(PLAYER_CLASSES)
     parser = argparse.ArgumentParser()
-    parser.add_argument('player1', choices=player_types)
-    parser.add_argument('player2', choices=player_types)
+    parser.add_argument('player1', nargs='?', choices=player_types)
+    parser.add_argument('player2', nargs='?', choices=player_types)
     parser.add_argument("--mode",   type=str, default="gui", choices=["gui", "server"])
     parser.add_argument('--time',   type=int, default=240, help='Time budget for each agent (int)')
     parser.add_argument('--dim' ,   type=int, default=4,   help='Dimension of the side of the (hexagonal) board (int)')
     parser.add_argument('--blocks', type=int, default=0,   help='Number of blocked cells in the board (int)')
     parser.add_argument("--start_file", type=str, default=None, help="Custom initial state of the game specified in havannah/initial_states/<filename>")
+    parser.add_argument('--ponder', type=float, default=0,   help='CPU share (0-1] AI agents may use on the opponent\'s time, 0 disables pondering (float)')
+    parser.add_argument('--workers', type=int, default=0,   help='Playout processes per AI agent for leaf-parallel search, 0 disables it (int)')
+    parser.add_argument('--tree_memory', type=float, default=0, help='Memory budget in MB of each AI agent\'s search tree, 0 leaves it unbounded (float)')
+    parser.add_argument('--win_cache', type=int, default=None, help='Entries of the AI agents\' terminal check cache, about 220 bytes each and not part of --tree_memory, 2^18 by default (int)')
+    parser.add_argument('--playout_weights', type=str, default=None, help='JSON file of the AI agents\' playout pattern probabilities (see playout.load_pattern_weights)')
+    parser.add_argument('--seed',   type=int, default=None, help='Seed of the board and of both agents, drawn at random and logged if not given (int)')
+    parser.add_argument('--sims',   type=int, default=0,   help='Simulations per search of AI agents instead of their time limit, 0 keeps the time limit (int)')
+    parser.add_argument('--replay', type=str, default=None, help='Re-run the searches of a logged game (e.g. logs.txt) instead of playing one')
+    parser.add_argument('--replay_moves', type=int, default=None, help='Replay only this many logged moves (int)')
     args = parser.parse_args()
-    main(args.player1, args.player2, args.time, args.dim, args.mode, args.start_file, args.blocks)
+    if args.replay is not None:
+        for k, record in enumerate(replay_game(args.replay, args.sims, args.replay_moves)):
+            status = '' if record['replayed'] in (None, record['logged']) else '  (differs)'
+            print(f"{k + 1:3d}. player {record['player']}: logged {record['logged']}, replayed {record['replayed']}"
+                  f" in {record['seconds']:.2f} s{status}")
+    elif args.player1 is None or args.player2 is None:
+        parser.error('player1 and player2 are required unless --replay is given')
+    else:
+        playout_weights = None
+        if args.playout_weights is not None:
+            from playout import load_pattern_weights
+            playout_weights = load_pattern_weights(args.playout_weights)
+        main(args.player1, args.player2, args.time, args.dim, args.mode, args.start_file, args.blocks, args.ponder, args.workers, args.tree_memory, args.seed, args.sims, args.win_cache, playout_weights)
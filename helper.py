@@ -1,13 +1,16 @@
 import heapq
+import random
 import numpy as np
-from collections import deque
+from queue import Queue
+from functools import lru_cache
+from collections import deque, OrderedDict
 from typing import List, Tuple, Dict, Union
 from multiprocessing import Array
 
 
 PLAYER_TIME = Array('f', [0, 0])
 HEXAGON_COORDS = {}
-CLICK_EVENT = [None]
+INPUT_EVENTS = Queue()  # moves entered by a human, from the GUI click handler or the stdin reader
 
 
 def is_valid(x, y, dims):
@@ -37,20 +40,99 @@ def fetch_remaining_time(timer, player_num: int) -> float:
     '''
     return timer[player_num - 1]
 
-def get_valid_actions(board: np.array, player: int = None) -> List[Tuple[int, int]]:
+def get_valid_actions(board: np.array, player: int = None, pool: 'EmptyCellPool' = None) -> List[Tuple[int, int]]:
     '''
     Returns all the valid actions in the provided state `board`
     
     # Parameters
     `board (numpy array)`: Game board
+    `pool (EmptyCellPool)`: Empty cells of `board`, kept up to date by the caller. If given, the actions are
+        read from the pool instead of scanning the board, in the pool's (unspecified) order
 
     # Returns
     List[Tuple[int]]: List of valid actions, coordinates of the valid moves
     '''
+    if pool is not None:
+        return pool.actions()
     valid_moves = np.argwhere(board == 0)
     valid_moves = [tuple(move) for move in valid_moves]
     return valid_moves
 
+
+class EmptyCellPool:
+    '''
+    The empty cells of a board, with O(1) removal, restore and uniform sampling
+
+    Cells are stored as flat indices in an array whose first `size` entries are the empty cells, along with
+    the position of every cell in that array. Removing a cell swaps it with the last empty entry, restoring
+    it swaps it back in, so undoing moves in any order is O(1) too.
+    '''
+
+    def __init__(self, board: np.array):
+        '''
+        # Parameters
+        `board (numpy array)`: Game board, the pool starts with its empty cells
+        '''
+        self.dim = board.shape[1]
+        self.cells = np.flatnonzero(board.ravel() == 0).tolist()
+        self.position = [-1] * board.size
+        for k, cell in enumerate(self.cells):
+            self.position[cell] = k
+        self.size = len(self.cells)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, move: Tuple[int, int]) -> bool:
+        i, j = move
+        if not (0 <= i < len(self.position) // self.dim and 0 <= j < self.dim):
+            return False
+        return 0 <= self.position[i * self.dim + j] < self.size
+
+    def copy(self) -> 'EmptyCellPool':
+        pool = EmptyCellPool.__new__(EmptyCellPool)
+        pool.dim = self.dim
+        pool.cells = self.cells.copy()
+        pool.position = self.position.copy()
+        pool.size = self.size
+        return pool
+
+    def _swap(self, k: int, l: int):
+        cells, position = self.cells, self.position
+        cells[k], cells[l] = cells[l], cells[k]
+        position[cells[k]] = k
+        position[cells[l]] = l
+
+    def remove(self, move: Tuple[int, int]):
+        '''
+        Removes a cell from the pool, once a stone is placed on it. The cell must be in the pool
+        '''
+        self.size -= 1
+        self._swap(self.position[move[0] * self.dim + move[1]], self.size)
+
+    def restore(self, move: Tuple[int, int]):
+        '''
+        Puts a removed cell back into the pool, when the stone on it is taken back
+        '''
+        self._swap(self.position[move[0] * self.dim + move[1]], self.size)
+        self.size += 1
+
+    def sample(self, rng=random) -> Tuple[int, int]:
+        '''
+        Returns an empty cell drawn uniformly at random. The pool must not be empty
+
+        # Parameters
+        `rng`: Source of randomness, anything with a `random()` method. Defaults to the `random` module
+        '''
+        return divmod(self.cells[int(rng.random() * self.size)], self.dim)
+
+    def actions(self) -> List[Tuple[int, int]]:
+        '''
+        Returns the empty cells as coordinates, like `get_valid_actions`
+        '''
+        dim = self.dim
+        return [divmod(cell, dim) for cell in self.cells[:self.size]]
+
 def get_vertices_on_edge(edge: int, dim: int) -> List[Tuple[int, int]]:
     '''
     Returns the vertices on an edge of the board
@@ -191,6 +273,104 @@ def get_neighbours(dim: int, vertex: Tuple[int, int]) -> List[Tuple[int, int]]:
         neighbours.append((i + 1, j - 1))
     return neighbours
 
+@lru_cache(maxsize=None)
+def get_cell_tables(dim: int) -> Tuple[List[List[int]], List[int], List[int]]:
+    '''
+    Returns lookup tables for every cell of a `dim` sized board, indexed by the flat index `i * dim + j`
+
+    # Parameters
+    dim (int): Dimension of the board
+
+    # Returns
+    Tuple[List[List[int]], List[int], List[int]]:
+        - neighbours: flat indices of the neighbours of each cell, in `get_neighbours` order
+        - corner: corner of each cell as returned by `get_corner`, -1 if not a corner
+        - edge: edge of each cell as returned by `get_edge`, -1 if not an edge
+    '''
+    neighbours, corner, edge = [], [], []
+    for i in range(dim):
+        for j in range(dim):
+            neighbours.append([x * dim + y for x, y in get_neighbours(dim, (i, j))])
+            corner.append(get_corner((i, j), dim))
+            edge.append(get_edge((i, j), dim))
+    return neighbours, corner, edge
+
+
+class GroupMap:
+    '''
+    Connected groups of one player's stones, labelled once and updated as stones are added
+
+    Every stone points towards a representative of its group (union-find). Each representative holds the
+    size of the group and bit masks of the corners (`get_corner`) and edges (`get_edge`) the group touches.
+    '''
+
+    def __init__(self, board: np.array, player: int):
+        '''
+        # Parameters
+        `board (numpy array)`: Game board
+        `player (int)`: Player whose stones are grouped
+        '''
+        dim = board.shape[0]
+        self.dim = dim
+        self.player = player
+        self.neighbours, self.corner, self.edge = get_cell_tables(dim)
+        self.parent = [-1] * (dim * dim)  # -1 for cells without a stone of `player`
+        self.size = [0] * (dim * dim)
+        self.corners = [0] * (dim * dim)
+        self.edges = [0] * (dim * dim)
+        for cell in np.flatnonzero(board.ravel() == player).tolist():
+            self.add_cell(cell)
+
+    def copy(self) -> 'GroupMap':
+        groups = GroupMap.__new__(GroupMap)
+        groups.dim = self.dim
+        groups.player = self.player
+        groups.neighbours, groups.corner, groups.edge = self.neighbours, self.corner, self.edge
+        groups.parent = self.parent.copy()
+        groups.size = self.size.copy()
+        groups.corners = self.corners.copy()
+        groups.edges = self.edges.copy()
+        return groups
+
+    def find(self, cell: int) -> int:
+        '''
+        Returns the group id (representative) of a flat cell index, -1 if the cell holds no stone of the player
+        '''
+        parent = self.parent
+        if parent[cell] == -1:
+            return -1
+        while parent[cell] != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    def group(self, move: Tuple[int, int]) -> int:
+        return self.find(move[0] * self.dim + move[1])
+
+    def add(self, move: Tuple[int, int]) -> int:
+        '''
+        Adds a stone of the player at `move`, merging the groups it touches. Returns the id of its group
+        '''
+        return self.add_cell(move[0] * self.dim + move[1])
+
+    def add_cell(self, cell: int) -> int:
+        self.parent[cell] = cell
+        self.size[cell] = 1
+        self.corners[cell] = 1 << self.corner[cell] if self.corner[cell] != -1 else 0
+        self.edges[cell] = 1 << self.edge[cell] if self.edge[cell] != -1 else 0
+        root = cell
+        for neighbour in self.neighbours[cell]:
+            other = self.find(neighbour)
+            if other != -1 and other != root:
+                if self.size[other] > self.size[root]:
+                    root, other = other, root
+                self.parent[other] = root
+                self.size[root] += self.size[other]
+                self.corners[root] |= self.corners[other]
+                self.edges[root] |= self.edges[other]
+        return root
+
+
 def get_all_corners(dim: int) -> List[Tuple[int, int]]:
     '''
     Returns vertices on all the corners of the board
@@ -624,6 +804,122 @@ def check_fork_and_bridge(board: np.array, move: Tuple[int, int]) -> Tuple[bool,
     return False, None
 
 
+def may_form_ring(board: np.array, move: Tuple[int, int], player_num: int) -> bool:
+    '''
+    O(1) gate for `check_ring`: whether the stone at `move` can have closed a ring at all
+
+    # Parameters
+    board (numpy array): Game board
+    move (Tuple[int, int]): Position of the move. Must have already been played (marked on the board)
+    player_num (int): Id of the player who made the move
+
+    # Returns
+    bool: False if no ring can pass through the move, True if `check_ring` has to decide
+    '''
+    neighbours = get_cell_tables(board.shape[0])[0]
+    own = [cell for cell in neighbours[move[0] * board.shape[0] + move[1]] if board.item(cell) == player_num]
+    return ring_possible(own, neighbours)
+
+
+def ring_possible(own: List[int], neighbours: List[List[int]]) -> bool:
+    # A ring through the stone enters and leaves it through two of its own neighbours. If those are adjacent,
+    # the ring could skip the stone, so it was already closed before the move
+    if len(own) >= 3:
+        return True
+    return len(own) == 2 and own[1] not in neighbours[own[0]]
+
+
+def may_win(board: np.array, move: Tuple[int, int], player_num: int, groups: GroupMap = None) -> bool:
+    '''
+    O(1) gate for `check_win`: whether the stone at `move` can have completed any structure. A stone without
+    a neighbour of its own player completes nothing. With the player's groups at hand, a bridge or fork is
+    read off the masks of the stone's group, leaving only the ring conditions
+
+    # Parameters
+    board (numpy array): Game board
+    move (Tuple[int, int]): Position of the move. Must have already been played (marked on the board)
+    player_num (int): Id of the player who made the move
+    groups (GroupMap): Groups of `player_num`, already including the move. Optional
+
+    # Returns
+    bool: False if the move cannot have won, True if `check_win` has to decide
+    '''
+    dim = board.shape[0]
+    neighbours = get_cell_tables(dim)[0]
+    cell = move[0] * dim + move[1]
+    own = [neighbour for neighbour in neighbours[cell] if board.item(neighbour) == player_num]
+    if not own:
+        return False
+    if groups is None:
+        return True
+    root = groups.find(cell)
+    if groups.corners[root].bit_count() >= 2 or groups.edges[root].bit_count() >= 3:
+        return True
+    return ring_possible(own, neighbours)
+
+
+class WinCache:
+    '''
+    LRU cache in front of `check_win`, keyed by (hash of the board before the move, move, player)
+
+    Moves that `may_win` rules out are answered without touching the cache, so it only holds the
+    results of full checks. The hash is supplied by the caller, usually a Zobrist hash kept up to date
+    move by move (see `symmetry.get_zobrist_keys`). A full cache takes about `ENTRY_BYTES` per entry,
+    some 55 MB at the default capacity
+    '''
+
+    ENTRY_BYTES = 220
+
+    def __init__(self, capacity: int = 1 << 18):
+        '''
+        # Parameters
+        `capacity (int)`: Maximum number of results kept
+        '''
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def check_win(self, board: np.array, move: Tuple[int, int], player_num: int, key: int) -> bool:
+        '''
+        Cached `check_win(board, move, player_num)[0]`
+
+        # Parameters
+        `board (numpy array)`: Game board, the move must have already been played
+        `move (Tuple[int, int])`: Position of the move
+        `player_num (int)`: Id of the player who made the move
+        `key (int)`: Hash of `board` before the move
+        '''
+        if not may_win(board, move, player_num):
+            return False
+        entry = (key, int(move[0]) * board.shape[0] + int(move[1]), player_num)
+        entries = self.entries
+        result = entries.get(entry)
+        if result is not None:
+            self.hits += 1
+            entries.move_to_end(entry)
+            return result
+        self.misses += 1
+        result = check_win(board, move, player_num)[0]
+        entries[entry] = result
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+        return result
+
+    def resize(self, capacity: int):
+        self.capacity = capacity
+        while len(self.entries) > capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 def check_win(board: np.array, move: Tuple[int, int], player_num: int, path:List[Tuple[int, int]]=None) -> Tuple[bool, Union[str, None]]:
     '''
     Checks if the player has won the game by placing a move at the given position
@@ -0,0 +1,172 @@
+# system libs
+import math
+import random
+import argparse
+import multiprocessing as mp
+from typing import Dict, Tuple
+
+# 3rd party lib
+import numpy as np
+
+# Local imports
+from game import get_random_board, get_start_board, play_game, PLAYER_CLASSES
+
+
+def expected_score(elo: float) -> float:
+    # Score of the stronger side at a logistic Elo difference
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def score_to_elo(score: float) -> float:
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+class SPRT:
+    '''
+    Sequential probability ratio test on the Elo difference of player A over player B
+
+    H0: elo = elo0 against H1: elo = elo1. Games are scored 1 / 0.5 / 0 for A, and the log likelihood ratio
+    uses the generalized SPRT approximation over those scores (the per game variance is estimated from the
+    games so far, so draws are accounted for). The test accepts H1 once the ratio exceeds log((1 - beta) / alpha)
+    and H0 once it falls under log(beta / (1 - alpha)).
+    '''
+
+    def __init__(self, elo0: float = 0, elo1: float = 10, alpha: float = 0.05, beta: float = 0.05):
+        '''
+        # Parameters
+        `elo0 (float)`: Elo difference under H0
+        `elo1 (float)`: Elo difference under H1, above elo0
+        `alpha (float)`: Probability of accepting H1 when H0 holds
+        `beta (float)`: Probability of accepting H0 when H1 holds
+        '''
+        self.elo0, self.elo1 = elo0, elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.wins = self.draws = self.losses = 0
+
+    def add(self, score: float):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    def mean_and_variance(self) -> Tuple[float, float]:
+        games = self.games
+        mean = (self.wins + 0.5 * self.draws) / games
+        variance = (self.wins + 0.25 * self.draws) / games - mean ** 2
+        return mean, variance
+
+    def llr(self) -> float:
+        if self.games == 0:
+            return 0.0
+        mean, variance = self.mean_and_variance()
+        if variance <= 0:
+            # Only one kind of result so far: count it as one game away from the opposite result
+            variance = 1 / (4 * (self.games + 1))
+        s0, s1 = expected_score(self.elo0), expected_score(self.elo1)
+        return (s1 - s0) * (2 * mean - s0 - s1) * self.games / (2 * variance)
+
+    def decision(self) -> str:
+        llr = self.llr()
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+    def elo(self) -> Tuple[float, float]:
+        '''
+        Returns the Elo estimate and the half width of its 95% confidence interval
+        '''
+        if self.games == 0:
+            return 0.0, float('inf')
+        mean, variance = self.mean_and_variance()
+        margin = 1.96 * math.sqrt(max(variance, 0) / self.games)
+        low, high = score_to_elo(mean - margin), score_to_elo(mean + margin)
+        return score_to_elo(mean), (high - low) / 2
+
+
+def play_match_game(spec: Dict) -> Tuple[int, float]:
+    '''
+    Plays one game of the match in a worker process
+
+    # Returns
+    Tuple[int, float]: Index of the game and the score of player A
+    '''
+    first, second = (spec['a'], spec['b']) if spec['a_first'] else (spec['b'], spec['a'])
+    result = play_game(first, second, spec['board'], spec['time'], seed=spec['seed'])
+    a_number = 1 if spec['a_first'] else 2
+    if result['winner'] == 0:
+        return spec['index'], 0.5
+    return spec['index'], 1.0 if result['winner'] == a_number else 0.0
+
+
+def game_specs(a: str, b: str, dim: int, blocks: int, start_file: str, time: float, max_games: int, seed: int):
+    # Games come in pairs on the same board, each player moving first once
+    rng = random.Random(seed)
+    for index in range(max_games):
+        if index % 2 == 0:
+            board_rng = np.random.RandomState(rng.getrandbits(32))
+            board = get_start_board(start_file) if start_file is not None else get_random_board(dim, blocks, board_rng)
+        yield {'index': index, 'a': a, 'b': b, 'a_first': index % 2 == 0, 'board': board, 'time': time,
+               'seed': rng.getrandbits(64)}
+
+
+def run_match(a: str, b: str, dim: int = 4, blocks: int = 0, start_file: str = None, time: float = 240,
+              max_games: int = 1000, parallel: int = None, sprt: SPRT = None, seed: int = None, report=print) -> Dict:
+    '''
+    Plays games between A and B on `parallel` processes until the SPRT decides or `max_games` are played
+
+    # Returns
+    Dict: games, wins / draws / losses of A, Elo estimate and 95% margin, LLR and decision (None if undecided)
+    '''
+    sprt = sprt or SPRT()
+    parallel = parallel or mp.cpu_count()
+    seed = random.getrandbits(64) if seed is None else seed
+    specs = game_specs(a, b, dim, blocks, start_file, time, max_games, seed)
+    decision = None
+    with mp.Pool(parallel) as pool:
+        for _, score in pool.imap_unordered(play_match_game, specs):
+            sprt.add(score)
+            decision = sprt.decision()
+            elo, margin = sprt.elo()
+            report(f'{sprt.games:5d} games  +{sprt.wins} ={sprt.draws} -{sprt.losses}  '
+                   f'elo {elo:+.1f} +/- {margin:.1f}  llr {sprt.llr():+.2f} [{sprt.lower:.2f}, {sprt.upper:.2f}]')
+            if decision is not None:
+                pool.terminate()
+                break
+    elo, margin = sprt.elo()
+    return {'games': sprt.games, 'wins': sprt.wins, 'draws': sprt.draws, 'losses': sprt.losses,
+            'elo': elo, 'elo_margin': margin, 'llr': sprt.llr(), 'decision': decision}
+
+
+if __name__ == '__main__':
+    player_types = [name for name in PLAYER_CLASSES if name != 'human']
+    parser = argparse.ArgumentParser()
+    parser.add_argument('player_a', choices=player_types)
+    parser.add_argument('player_b', choices=player_types)
+    parser.add_argument('--time',   type=float, default=240, help='Time budget for each agent per game (float)')
+    parser.add_argument('--dim' ,   type=int, default=4,   help='Dimension of the side of the (hexagonal) board (int)')
+    parser.add_argument('--blocks', type=int, default=0,   help='Number of blocked cells in the board (int)')
+    parser.add_argument("--start_file", type=str, default=None, help="Custom initial state of the games specified in havannah/initial_states/<filename>")
+    parser.add_argument('--games',  type=int, default=1000, help='Maximum number of games (int)')
+    parser.add_argument('--parallel', type=int, default=None, help='Games played at once, defaults to the number of cores (int)')
+    parser.add_argument('--elo0',   type=float, default=0,   help='Elo difference of A over B under H0 (float)')
+    parser.add_argument('--elo1',   type=float, default=10,  help='Elo difference of A over B under H1 (float)')
+    parser.add_argument('--alpha',  type=float, default=0.05, help='False positive rate (float)')
+    parser.add_argument('--beta',   type=float, default=0.05, help='False negative rate (float)')
+    parser.add_argument('--seed',   type=int, default=None, help='Seed of the boards and of the players\' randomness (int)')
+    args = parser.parse_args()
+    result = run_match(args.player_a, args.player_b, args.dim, args.blocks, args.start_file, args.time, args.games,
+                       args.parallel, SPRT(args.elo0, args.elo1, args.alpha, args.beta), args.seed)
+    verdict = {'H1': f'A is stronger (elo >= {args.elo1})', 'H0': f'A is not stronger (elo <= {args.elo0})',
+               None: 'undecided'}[result['decision']]
+    print(f"{verdict} after {result['games']} games: elo {result['elo']:+.1f} +/- {result['elo_margin']:.1f}, "
+          f"llr {result['llr']:+.2f}")
@@ -3,12 +3,64 @@ import math
 import random
 import numpy as np
 from pprint import pprint
+from functools import lru_cache
 import sys
+import json
 from helper import *
+from playout import get_batch_playout, policy_playout, PlayoutPool, PATTERN_WEIGHTS
+from solver import ProofNumberSolver
+from symmetry import board_hash, get_zobrist_keys
 
 corners = set()
 # edges = set()
 
+# Proven game values, from the point of view of the player to move in a node
+PROVEN_WIN = 1
+PROVEN_LOSS = -1
+
+# Weights of combined_heuristic and heuristic_locality, and the UCB exploration constant C of MCTS
+HEURISTIC_PARAMS = {
+    'group_bonus': 2,
+    'conn_bonus': 20,
+    'three_connector_bonus': 11,
+    'locality_bonus': 2,
+    'local_reply_bonus': 3,
+    'maintain_vc_bonus': 100,
+    'neighbour_bonus': 3,
+    'virtual_conn_bonus': 2,
+    'virtual_conn_pro_bonus': 5,
+    'not_virtual_conn_bonus': 1,
+    'panic_threat_bonus': 300,
+    'C': 1.41,
+}
+
+# Parameters that change the play: dfs_pro always scores groups 0, which leaves group_bonus unused and
+# zeroes maintain_vc_bonus, so tuning either only adds noise
+TUNABLE_PARAMS = [name for name in HEURISTIC_PARAMS if name not in ('group_bonus', 'maintain_vc_bonus')]
+
+def load_params(path):
+    """
+    Reads heuristic parameters from a JSON object of parameter name to value. Parameters missing
+    from the file keep their default value
+
+    # Parameters
+    `path (str)`: Path of the JSON file
+
+    # Returns
+    Dict[str, float]: Value of every parameter of `HEURISTIC_PARAMS`
+    """
+    with open(path) as file:
+        table = json.load(file)
+    unknown = set(table) - set(HEURISTIC_PARAMS)
+    if unknown:
+        raise ValueError(f'Unknown heuristic parameters: {sorted(unknown)}')
+    params = dict(HEURISTIC_PARAMS)
+    params.update({name: float(value) for name, value in table.items()})
+    return params
+
+# Terminal checks of the tree nodes, shared by every search in the process. Resize with WIN_CACHE.resize
+WIN_CACHE = WinCache()
+
 class AIPlayer:
 
     def __init__(self, player_number: int, timer):
@@ -27,8 +79,31 @@ class AIPlayer:
         self.player_string = 'Player {}: ai'.format(player_number)
         self.timer = timer
         self.previous_state = None
+        self.last_opponent_move = None # set by the game engine before every get_move, when it knows the move
         self.opponent = 3 - player_number
         self.initialized_globals = False
+        # Endgame solver: used once at most `solver_threshold` cells are empty
+        self.solver = ProofNumberSolver(player_number, node_limit=50000)
+        self.solver_threshold = 16
+        self.solver_time_limit = 5
+        # Subtree kept after our move (opponent to move), reused on the next move and grown while pondering
+        self.tree = None
+        self.ponder_cpu_share = 0 # fraction of a core used while the opponent thinks, 0 disables pondering
+        self.ponder_slice = 0.05 # seconds of search between checks for the opponent's move
+        self.playout_batch = 1 # playouts per MCTS leaf, run vectorized when above 1
+        self.playout_weights = PATTERN_WEIGHTS # see playout.load_pattern_weights to read them from a file
+        self.workers = 0 # playout processes for leaf-parallel search, 0 runs playouts in this process
+        self.playout_pool = None
+        # Tree budget, least visited subtrees are pruned beyond it. None leaves the tree unbounded
+        self.node_limit = None
+        self.memory_limit = None # bytes
+        self.ponder_search = None
+        self.move_time = 10 # seconds of search per move
+        self.root_visits = None # action -> visits of the root's children in the last search, None if no search ran
+        self.params = HEURISTIC_PARAMS # see load_params to read them from a file
+        self.simulation_limit = None # bounds each search by simulations instead of move_time when set
+        self.rng = random # playout randomness, a seeded random.Random after set_seed
+        self.batch_rng = None # numpy Generator of the vectorized playouts, None draws a fresh one per call
 
 
     def get_move(self, state: np.array) -> Tuple[int, int]:
@@ -47,6 +122,8 @@ class AIPlayer:
         # Returns
         Tuple[int, int]: action (coordinates of a board cell)
         """
+        tree, self.tree = self.tree, None
+        self.root_visits = None
         # Check_immidiate_termination
         win_action = self.can_win(state)
         if win_action:
@@ -55,7 +132,12 @@ class AIPlayer:
         opp_win_action = self.will_opp_win(state)
         if opp_win_action:
             return opp_win_action
-        
+
+        solved_action = self.solve_endgame(state)
+        if solved_action:
+            self.previous_state = self.make_move(state, solved_action, self.player_number)
+            return solved_action
+
         dim = state.shape[0]
         if not self.initialized_globals:
             cor = get_all_corners(dim)
@@ -64,18 +146,164 @@ class AIPlayer:
             
         # print("State we got")
         # pprint(state.copy())
-        opponent_move = None
-        if self.previous_state is not None:
+        opponent_move = self.last_opponent_move
+        if opponent_move is None and self.previous_state is not None:
             opponent_move = self.identify_opponent_move(self.previous_state, state)
-        root = MCTSNode(state, self.player_number, action=opponent_move)
-        mcts = MCTS(root, self.player_number)
+        root = self.reuse_tree(tree, state, opponent_move)
+        if root is None:
+            root = MCTSNode(state, self.player_number, action=opponent_move, params=self.params)
+        mcts = self.new_search(root, self.player_number)
+        if self.workers > 0:
+            if self.playout_pool is None:
+                self.playout_pool = PlayoutPool(self.workers, seed=self.rng.getrandbits(32))
+            mcts.workers = self.playout_pool
         best_action = mcts.search()
+        self.root_visits = {child.action: child.visits for child in root.children}
         self.previous_state = best_action.state
+        best_action.parent = None
+        self.tree = best_action
         best_action_to_int = (int(best_action.action[0]), int(best_action.action[1]))
         # print("State Returned")
         # pprint(best_action.state)
         return best_action_to_int
     
+    def new_search(self, root, player):
+        mcts = MCTS(root, player)
+        mcts.time_limit = self.move_time
+        if self.simulation_limit is not None:
+            mcts.simulation_limit = self.simulation_limit
+            mcts.time_limit = float('inf')
+        mcts.rng = self.rng
+        mcts.batch_rng = self.batch_rng
+        mcts.C = self.params['C']
+        mcts.playout_batch = self.playout_batch
+        mcts.playout_weights = self.playout_weights
+        mcts.node_limit = self.node_limit
+        mcts.memory_limit = self.memory_limit
+        return mcts
+
+    def solve_endgame(self, state):
+        # Solve exactly once the remaining tree is small; returns None to fall back to MCTS
+        if len(get_valid_actions(state)) > self.solver_threshold:
+            return None
+        budget = min(self.solver_time_limit, fetch_remaining_time(self.timer, self.player_number) / 4)
+        # Bounded by simulations, the search must not depend on the clock: only the node limit stops the solver
+        deadline = time.time() + budget if self.simulation_limit is None else None
+        result, action = self.solver.solve(state, deadline=deadline)
+        if result is None:
+            return None
+        return (int(action[0]), int(action[1]))
+
+    def reuse_tree(self, tree, state, opponent_move):
+        # Continue from the subtree of the opponent's move, keeping everything searched for it so far
+        if tree is None or opponent_move is None:
+            return None
+        for child in tree.children:
+            if child.action == opponent_move and np.array_equal(child.state, state):
+                child.parent = None
+                return child
+        return None
+
+    def set_pondering(self, cpu_share: float):
+        """
+        Enable pondering: the player worker calls `ponder` while the opponent thinks
+
+        # Parameters
+        `cpu_share (float)`: Fraction of a core to use while pondering, in (0, 1]. 0 disables pondering
+        """
+        self.ponder_cpu_share = cpu_share
+
+    def set_tree_budget(self, node_limit: int = None, memory_limit: int = None):
+        """
+        Bound the search tree. Once it outgrows either limit, its least visited subtrees are collapsed
+        into their parents and re-expanded if the search comes back to them
+
+        # Parameters
+        `node_limit (int)`: Maximum number of tree nodes, None for no bound
+        `memory_limit (int)`: Maximum estimated size of the tree in bytes, None for no bound
+        """
+        self.node_limit = node_limit
+        self.memory_limit = memory_limit
+        self.ponder_search = None
+
+    def set_playout_weights(self, weights: Dict[str, float]):
+        """
+        Use other pattern probabilities in the playouts (see `playout.load_pattern_weights`)
+
+        # Parameters
+        `weights (Dict[str, float])`: Probability of each pattern of `PATTERN_WEIGHTS`
+        """
+        self.playout_weights = weights
+        self.ponder_search = None
+
+    def set_win_cache(self, capacity: int):
+        """
+        Resize the cache of terminal checks. It is shared by every search of the process and is not part of
+        the tree budget, each entry takes about `WinCache.ENTRY_BYTES`
+
+        # Parameters
+        `capacity (int)`: Maximum number of cached results
+        """
+        WIN_CACHE.resize(capacity)
+
+    def set_seed(self, seed: int):
+        """
+        Draw all the randomness of the search from streams derived from `seed`
+
+        # Parameters
+        `seed (int)`: Seed of the playouts of this player, and of its playout workers
+        """
+        self.rng = random.Random(seed)
+        self.batch_rng = np.random.default_rng(seed)
+
+    def set_simulation_limit(self, simulations: int):
+        """
+        Stop every search after `simulations` simulations rather than after `move_time` seconds, so that with a
+        seed (and without pondering or playout workers) the same position always gets the same search
+
+        # Parameters
+        `simulations (int)`: Simulations per search, None to go back to the time limit
+        """
+        self.simulation_limit = simulations
+        self.ponder_search = None
+
+    def set_workers(self, workers: int):
+        """
+        Run the playouts of the search on a persistent pool of `workers` processes, started on the next move
+
+        # Parameters
+        `workers (int)`: Number of playout processes, 0 runs playouts in this process
+        """
+        if self.playout_pool is not None:
+            self.playout_pool.close()
+            self.playout_pool = None
+        self.workers = workers
+
+    def ponder(self) -> bool:
+        """
+        Grow the tree kept from our last move for one slice of `ponder_slice` seconds
+
+        # Returns
+        bool: False once there is nothing left to ponder on
+        """
+        if self.tree is None:
+            return False
+        # Kept across slices, so the tree is only measured once per move
+        if self.ponder_search is None or self.ponder_search.root is not self.tree:
+            self.ponder_search = self.new_search(self.tree, self.opponent)
+        mcts = self.ponder_search
+        end_time = time.time() + self.ponder_slice
+        while time.time() < end_time:
+            if self.tree.proven or self.tree.visits >= mcts.simulation_limit:
+                return False
+            if mcts.iterate() is not None:
+                return False
+        return True
+
+    def ponder_idle_time(self) -> float:
+        # Idle time after each slice, so pondering stays within its CPU share
+        return self.ponder_slice * (1 - self.ponder_cpu_share) / self.ponder_cpu_share
+
     def identify_opponent_move(self, previous_state, current_state):
         for i in range(previous_state.shape[0]):
             for j in range(previous_state.shape[1]):
@@ -102,28 +330,66 @@ class AIPlayer:
         return new_state
     
     
+@lru_cache(maxsize=None)
+def second_layer_connections(dim, move):
+    # Neighbours, virtual connections and other second layer cells of a move; depends on the board size only
+    umap = {}
+    neighbours = get_neighbours(dim, move)
+    virtual_connections = []
+    neighbours_set = set(neighbours)
+    non_virtual_connections = []
+    for neighbour in neighbours:
+        umap[neighbour] = 1
+    for neighbour in neighbours:
+        umap[neighbour] = 1
+    for neighbour in neighbours:
+        #get neighbours of neighbour
+        neighbour_neighbours = get_neighbours(dim, neighbour)
+        for n in neighbour_neighbours:  
+            if n in umap:
+                umap[n]+=1
+            else:
+                umap[n] = 1
+    for key in umap:
+        if umap[key] == 2:
+            if key not in neighbours_set:
+                virtual_connections.append(key)
+        elif umap[key] == 1:
+            non_virtual_connections.append(key)
+
+    return neighbours, virtual_connections, non_virtual_connections
+
+
 class MCTSNode:
-    def __init__(self, state, player, parent=None, action=None):
+    def __init__(self, state, player, parent=None, action=None, params=None):
         self.state = state
         self.parent = parent
         self.action = action # action that led to this state by opponent
         self.player = player # player to take action on this state
         self.opponent = 3 - player
+        self.params = params if params is not None else HEURISTIC_PARAMS # heuristic weights, shared with the children
         self.children = []
         self.visits = 0
         self.wins = 0
+        self.hash = self.get_hash() # Zobrist hash of the state
 
         self.is_terminal = self.check_terminal() #bool : player in parent node has Already Won the game!! 
         self.will_opp_win = self.check_opp_win() #bool : parent node player's opponent will win if we take this action
+        self.proven = PROVEN_LOSS if self.is_terminal else 0 # solved game value for self.player, 0 while unknown
 
-        self.valid_actions = get_valid_actions(self.state)
+        if parent is not None:
+            # Same order as get_valid_actions, without rescanning the board
+            self.valid_actions = [move for move in parent.valid_actions if move != action]
+        else:
+            self.valid_actions = get_valid_actions(self.state)
+        self.groups = self.get_groups() # groups of the player to move, shared by all heuristics
         self.heuristic_scores = self.get_heuristic_scores()
         self.unexplored_actions = self.get_unexplored_actions()
         # self.neighbouring_nodes = self.get_neighbouring_nodes()
 
     def add_child(self, action):
         child_state = self.make_move(self.state, action, self.player)
-        child = MCTSNode(child_state, self.opponent, parent=self, action=action)
+        child = MCTSNode(child_state, self.opponent, parent=self, action=action, params=self.params)
         self.children.append(child)
         return child
 
@@ -131,15 +397,47 @@ class MCTSNode:
         new_state = state.copy()
         new_state[move] = player
         return new_state
+
+    def memory_size(self):
+        # Estimated bytes held by this node alone, not counting the move tuples shared with its parent
+        size = sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.state)
+        for container in (self.children, self.valid_actions, self.unexplored_actions):
+            size += sys.getsizeof(container)
+        size += sys.getsizeof(self.heuristic_scores) + sum(sys.getsizeof(score) for score in self.heuristic_scores.values())
+        groups = self.groups
+        for table in (groups.parent, groups.size, groups.corners, groups.edges):
+            size += sys.getsizeof(table)
+        return size
+
+    def update_proven(self):
+        # Win if some move leaves the opponent proven lost, loss once every move leaves the opponent proven winning
+        if not self.proven:
+            if any(child.proven == PROVEN_LOSS for child in self.children):
+                self.proven = PROVEN_WIN
+            elif self.children and not self.unexplored_actions and all(child.proven == PROVEN_WIN for child in self.children):
+                self.proven = PROVEN_LOSS
+        return self.proven
+
+    def get_hash(self):
+        if self.parent is None:
+            return board_hash(self.state)
+        dim = self.state.shape[0]
+        keys = get_zobrist_keys(dim)[self.action[0] * dim + self.action[1]]
+        return self.parent.hash ^ keys[0] ^ keys[self.opponent]
+
     def check_terminal(self):
+        # self.state is the parent's state with the opponent's stone at self.action
         if self.parent:
-            state = self.make_move(self.parent.state, self.action, self.opponent)
-            return check_win(state, self.action, self.opponent)[0]
+            return WIN_CACHE.check_win(self.state, self.action, self.opponent, self.parent.hash)
         return False
     def check_opp_win(self):
+        # Swap the stone at self.action for a moment instead of copying the parent's state
         if self.parent:
-            state = self.make_move(self.parent.state, self.action, self.player)
-            return check_win(state, self.action, self.player)[0]
+            self.state[self.action] = self.player
+            try:
+                return WIN_CACHE.check_win(self.state, self.action, self.player, self.parent.hash)
+            finally:
+                self.state[self.action] = self.opponent
         return False
     def get_unexplored_actions(self):
         actions = self.valid_actions.copy()
@@ -158,7 +456,24 @@ class MCTSNode:
         return neighbouring_nodes
 
     
+    def get_grandparent(self):
+        # Closest ancestor with the same player to move, differing by one stone of each player
+        if self.parent is None or self.parent.parent is None:
+            return None
+        return self.parent.parent
+
+    def get_groups(self):
+        grandparent = self.get_grandparent()
+        if grandparent is None:
+            return GroupMap(self.state, self.player)
+        groups = grandparent.groups.copy()
+        groups.add(self.parent.action)
+        return groups
+
     def get_heuristic_scores(self):
+        grandparent = self.get_grandparent()
+        if grandparent is not None:
+            return self.update_heuristic_scores(grandparent)
         heuristic_scores = {}
         state = self.state.copy()
         valid_actions = self.valid_actions
@@ -167,6 +482,33 @@ class MCTSNode:
             score = self.combined_heuristic(state, move, player)
             heuristic_scores[move] = score
         return heuristic_scores
+
+    def update_heuristic_scores(self, grandparent):
+        # Scores of a move only look two rings around it, plus the group through its last neighbour. Starting from
+        # the grandparent's scores, recompute the cells within two rings of the two new stones and of the previous
+        # last move, and the cells next to the group our new stone joined
+        dim = self.state.shape[0]
+        affected = set()
+        for move in (self.parent.action, self.action, grandparent.action):
+            if move is not None:
+                for cells in second_layer_connections(dim, move):
+                    affected.update(cells)
+        groups = self.groups
+        joined = groups.group(self.parent.action)
+        for move in self.valid_actions:
+            if groups.find(groups.neighbours[move[0] * dim + move[1]][-1]) == joined:
+                affected.add(move)
+
+        heuristic_scores = {}
+        state = self.state.copy()
+        player = self.player
+        previous_scores = grandparent.heuristic_scores
+        for move in self.valid_actions:
+            if move in affected:
+                heuristic_scores[move] = self.combined_heuristic(state, move, player)
+            else:
+                heuristic_scores[move] = previous_scores[move]
+        return heuristic_scores
     
 
 
@@ -181,14 +523,15 @@ class MCTSNode:
         # opp_group_score, opp_conn_score = self.get_group_size(state,move,dim,3-player)
         vc_score= self.heuristic_maintain_vc(state,self.action,player,move)
         # group_score -= 1 #To account for the move itself
-        group_bonus = 2
-        conn_bonus = 20
-        three_connector_bonus = 11
+        params = self.params
+        group_bonus = params['group_bonus']
+        conn_bonus = params['conn_bonus']
+        three_connector_bonus = params['three_connector_bonus']
         # max_group_score = (3*dimension*dimension-3*dimension+1)//dimension
         # group_score = max(group_score,max_group_score)
-        locality_bonus = 2
-        local_reply_bonus = 3
-        maintain_vc_bonus = 100
+        locality_bonus = params['locality_bonus']
+        local_reply_bonus = params['local_reply_bonus']
+        maintain_vc_bonus = params['maintain_vc_bonus']
         if group_score == 0:
             maintain_vc_bonus = 0
 
@@ -208,11 +551,12 @@ class MCTSNode:
         locality_score = 0
         local_reply_score = 0
 
-        neighbour_bonus = 3
-        virtual_conn_bonus = 2
-        virtual_conn_pro_bonus= 5
-        not_virtual_conn_bonus = 1
-        panic_threat_bonus = 300
+        params = self.params
+        neighbour_bonus = params['neighbour_bonus']
+        virtual_conn_bonus = params['virtual_conn_bonus']
+        virtual_conn_pro_bonus = params['virtual_conn_pro_bonus']
+        not_virtual_conn_bonus = params['not_virtual_conn_bonus']
+        panic_threat_bonus = params['panic_threat_bonus']
         for pos in neighbours:
             if state[pos] == player:
                 locality_score += neighbour_bonus
@@ -243,10 +587,15 @@ class MCTSNode:
                     local_reply_score += virtual_conn_pro_bonus
                     new_state=state.copy()
                     new_state[pos] = 3-player
+                    # state is this node's state (pos already holds the last move), hashed move by move from there
+                    key = self.hash
+                    zobrist = get_zobrist_keys(dim)
                     for vc_neighbour in neighbors_under_vc:
                         new_state[vc_neighbour] = 3-player
-                        if (check_win(new_state, vc_neighbour, 3-player)[0]):
+                        if WIN_CACHE.check_win(new_state, vc_neighbour, 3-player, key):
                             locality_score += panic_threat_bonus
+                        cell = zobrist[vc_neighbour[0] * dim + vc_neighbour[1]]
+                        key ^= cell[0] ^ cell[3-player]
                     
         for pos in not_virtual_conn:
             if state[pos] == player:
@@ -257,123 +606,47 @@ class MCTSNode:
 
 
     def get_second_layer_connections(self, board, move, dim):
-        umap = {}
-        neighbours = get_neighbours(dim, move)
-        virtual_connections = []
-        neighbours_set = set(neighbours)
-        non_virtual_connections = []
-        for neighbour in neighbours:
-            umap[neighbour] = 1
-        for neighbour in neighbours:
-            umap[neighbour] = 1
-        for neighbour in neighbours:
-            #get neighbours of neighbour
-            neighbour_neighbours = get_neighbours(dim, neighbour)
-            for n in neighbour_neighbours:  
-                if n in umap:
-                    umap[n]+=1
-                else:
-                    umap[n] = 1
-        for key in umap:
-            if umap[key] == 2:
-                if key not in neighbours_set:
-                    virtual_connections.append(key)
-            elif umap[key] == 1:
-                non_virtual_connections.append(key)
-
-        return neighbours, virtual_connections, non_virtual_connections
-    
+        return second_layer_connections(dim, move)
+
     def get_group_size(self, state, move, dim, player):
         # new_board = self.make_move(state, move, player)
         grp_size, connectivity = self.dfs_pro(state, move, dim, player)
         return grp_size, connectivity
     
-    def dfs(self, state, move, dim, player):
-        visited = set()
-        visited_edges = set()
-        connectivity = 0
-        group=set()
-        connectors=set()
-        stack = [move]                          
-        grp_size = 0
-        while stack:
-            move = stack.pop()
-            if state[move] == player and move not in visited:   
-                visited.add(move)
-                grp_size += 1
-                group.add(move)
-                if move in corners: # global variable corners
-                    connectivity += 1
-                    connectors.add(move)
-                else:
-                    # if move in edges: # global variable edges
-                        edge = get_edge(move,dim)
-                        if edge != -1 and edge not in visited_edges:
-                            visited_edges.add(edge)
-                            connectivity += 1
-                            connectors.add(edge)
-                neighbours = get_neighbours(dim, move)
-                for neighbour in neighbours:
-                    if state[neighbour] == player:
-                        stack.append(neighbour)
-        return group, connectors
-    
     def dfs_pro(self, state, move, dim, player):
-        neighbours= get_neighbours(dim,move)
-        neighbours_under_player = []
-        total_group = set()
-        total_connectors = set()
-        grp_score_needed = False
+        # O(6) lookups into the node's group map. Only the group through the last listed neighbour is
+        # counted: the flood fill this replaces only ever reached that group, so merges never score a group size
+        groups = self.groups
+        cell = move[0] * dim + move[1]
+        neighbours = groups.neighbours[cell]
+        flat_state = state.ravel()
+        has_player_neighbour = any(flat_state[neighbour] == player for neighbour in neighbours)
+        corner_mask = edge_mask = 0
+        group = groups.find(neighbours[-1])
+        if group != -1:
+            corner_mask, edge_mask = groups.corners[group], groups.edges[group]
+
         conn_score_needed = False
         conn_score = 0
-        for neighbour in neighbours:
-            if state[neighbour] == player:
-                neighbours_under_player.append(neighbour)
-        
-        for i in range(len(neighbours_under_player)):
-            if neighbour not in total_group:
-                group, connectors = self.dfs(state, neighbour, dim, player)
-                if (i==0):
-                    total_group.update(group)
-                    total_connectors.update(connectors)
-                else:
-                    size_total_group = len(total_group)
-                    total_group.update(group)
-                    new_size_total_group = len(total_group)
-                    if new_size_total_group > size_total_group and i!=0:
-                        grp_score_needed = True
-                    size_total_connectors = len(total_connectors)
-                    total_connectors.update(connectors)
-                    new_size_total_connectors = len(total_connectors)
-                    if new_size_total_connectors > size_total_connectors:
-                        conn_score_needed = True
-        if (move in corners):
-            if len(neighbours_under_player)==0:
-                    conn_score_needed = False
-                    conn_score = 0.4
+        corner = groups.corner[cell]
+        if corner != -1:
+            if not has_player_neighbour:
+                conn_score = 0.4
             else:
                 conn_score_needed = True
-                total_connectors.add(move)
-        edge = get_edge(move,dim)
-        if (edge != -1):
-            if edge not in total_connectors:
-                if len(neighbours_under_player)==0:
-                    conn_score_needed = False
-                    conn_score = 0.4
-                else:
-                    conn_score_needed = True
-                    total_connectors.add(edge)
-
-        if grp_score_needed:
-            grp_score = len(total_group)
-        else:
-            grp_score = 0
+                corner_mask |= 1 << corner
+        edge = groups.edge[cell]
+        if edge != -1 and not edge_mask & (1 << edge):
+            if not has_player_neighbour:
+                conn_score = 0.4
+            else:
+                conn_score_needed = True
+                edge_mask |= 1 << edge
+
         if conn_score_needed:
-            conn_score = len(total_connectors)
-        
-        return grp_score, conn_score  
+            conn_score = bin(corner_mask).count('1') + bin(edge_mask).count('1')
+        return 0, conn_score
 
-    
     def heuristic_maintain_vc(self,state,last_move,player,move):
         if not last_move:
             return 0
@@ -402,16 +675,17 @@ class MCTSNode:
         return score
 
     def three_connector_move_heuristic(self, state, move, dim, player):
-        neighbours= get_neighbours(dim,move)
+        groups = self.groups
+        flat_state = state.ravel()
         i=0
-        edges=[]
-        for neighbour in neighbours:
-            if state[neighbour]==0:
-                if neighbour in corners:
+        edges=0
+        for neighbour in groups.neighbours[move[0] * dim + move[1]]:
+            if flat_state[neighbour]==0:
+                if groups.corner[neighbour] != -1:
                     i+=1
-                edge = get_edge(neighbour,dim)
-                if (edge != -1) and (edge not in edges):
-                    edges.append(edge)
+                edge = groups.edge[neighbour]
+                if (edge != -1) and not edges & (1 << edge):
+                    edges |= 1 << edge
                     i+=1
         if i==3:
             return True
@@ -422,36 +696,181 @@ class MCTS:
         self.player = player
         self.opponent = 3 - player
         self.total_simulations = 0
-        self.C = 1.41
+        self.C = HEURISTIC_PARAMS['C']
         self.simulation_limit = 10000
         self.time_limit = 10
+        self.playout_batch = 1 # playouts per leaf, more than 1 runs them vectorized
+        self.playout_weights = PATTERN_WEIGHTS # pattern probabilities of the playout policy
+        self.rng = random # source of the playouts' randomness
+        self.batch_rng = None # numpy Generator of the vectorized playouts
+        self.workers = None # PlayoutPool, runs the playouts of several leaves at once
+        self.pending = {} # token -> leaf waiting on the workers
+        self.next_token = 0
+        self.node_limit = None # tree nodes kept at most, None for no bound
+        self.memory_limit = None # estimated tree bytes kept at most, None for no bound
+        self.prune_ratio = 0.9 # pruning stops once the tree is down to this share of its budget
+        self.tree_size = None # counted on the first budget check
+        self.pruned_nodes = 0
+        self.prune_passes = 0
     
     def search(self):
         start_time = time.time()
         print(self.player)
         print("Rolling out")
+        if self.workers is not None:
+            self.workers.set_root(self.root.state, self.root.player, self.playout_weights)
+        decided = self.run(start_time)
+        if self.workers is not None:
+            self.collect_leaves(self.workers.drain())
+        print()
+        if self.tree_size is not None:
+            print(f'Tree: {self.tree_size} nodes, pruned {self.pruned_nodes} in {self.prune_passes} passes')
+            print(f'Win cache: {WIN_CACHE.hits} hits, {WIN_CACHE.misses} misses, {len(WIN_CACHE)} entries')
+        if decided:
+            return decided
+        if self.root.proven == PROVEN_WIN:
+            return next(child for child in self.root.children if child.proven == PROVEN_LOSS)
+        return self.get_best_action(self.cmp_visits)
+
+    def run(self, start_time):
         while time.time() - start_time < self.time_limit:
+            # The root is solved, no simulation can change the move
+            if self.root.proven:
+                break
             # Clear the last print statement
             print(f'\r{self.total_simulations}', end='', flush=True)
-            self.total_simulations += 1
+            if self.workers is None: # leaf-parallel rounds count their playouts as they are submitted
+                self.total_simulations += 1
             if(self.total_simulations > self.simulation_limit):
                 break
 
-            reward = 0
-            node, is_terminal = self.select(self.root) #while selecting in each level we expand the node
-            #if terminating condition is reached in root node we simply return them
+            decided = self.iterate() if self.workers is None else self.iterate_parallel()
+            if decided:
+                return decided
+        return None
+            
+    def iterate(self):
+        # One select / simulate / backpropagate round. Returns a child of the root that decides the move, if found
+        reward = 0
+        node, is_terminal = self.select(self.root) #while selecting in each level we expand the node
+        #if terminating condition is reached in root node we simply return them
+        if node.is_terminal or node.will_opp_win:
+            if node.parent == self.root:
+                return node
+        if not (is_terminal or node.is_terminal):
+            if self.playout_batch > 1:
+                rewards = self.simulate_batch(node.state, node.player, self.playout_batch)
+            else:
+                rewards = [self.simulate(node.state, node.player, node.action)]
+        else:
+            rewards = [3-node.player]
+        for reward in rewards:
+            self.backpropagate(node, reward)
+        self.enforce_tree_budget()
+        return None
+
+    def iterate_parallel(self):
+        # Hand a leaf to every idle worker, then fold in the results that are back. Pending leaves carry a
+        # virtual loss, so the following selections look elsewhere
+        while self.workers.idle() and not self.root.proven:
+            node, is_terminal = self.select(self.root)
             if node.is_terminal or node.will_opp_win:
                 if node.parent == self.root:
                     return node
-            if not is_terminal:
-                reward = self.simulate(node.state, node.player)
-            else:
-                reward = 3-node.player
-            self.backpropagate(node, reward)
+            if is_terminal or node.is_terminal:
+                self.backpropagate(node, 3-node.player)
+                continue
+            count = self.playout_batch
+            self.add_virtual_loss(node, count)
+            self.pending[self.next_token] = node
+            self.workers.submit(self.next_token, self.get_leaf_moves(node), count)
+            self.next_token += 1
+            self.total_simulations += count
+        self.collect_leaves(self.workers.collect())
+        self.enforce_tree_budget()
+        return None
+
+    def collect_leaves(self, results):
+        for token, rewards in results:
+            node = self.pending.pop(token)
+            self.add_virtual_loss(node, -len(rewards))
+            for reward in rewards:
+                self.backpropagate(node, reward)
+
+    def add_virtual_loss(self, node, count):
+        # Count `count` visits without wins for the player moving into each node on the path
+        while node:
+            node.visits += count
+            node = node.parent
+
+    def get_tree_budget(self):
+        # Node budget implied by both limits, None if the tree is unbounded
+        limits = []
+        if self.node_limit is not None:
+            limits.append(self.node_limit)
+        if self.memory_limit is not None:
+            # The root has the most valid actions, so it bounds the size of every node below it
+            limits.append(self.memory_limit // self.root.memory_size())
+        return max(1, min(limits)) if limits else None
+
+    def enforce_tree_budget(self):
+        budget = self.get_tree_budget()
+        if budget is None:
+            return
+        if self.tree_size is None:
+            self.tree_size = sum(1 for _ in self.iter_tree())
+        if self.tree_size > budget:
+            self.prune_tree(int(budget * self.prune_ratio))
+
+    def iter_tree(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children)
+
+    def prune_tree(self, target):
+        # Collapse the least visited subtrees until at most `target` nodes are left. A collapsed node's
+        # visits already count in its parent, its action goes back to the parent's unexplored actions
+        nodes = list(self.iter_tree())
+        sizes = {}
+        for node in reversed(nodes):
+            sizes[id(node)] = 1 + sum(sizes[id(child)] for child in node.children)
+        busy = set()
+        for node in self.pending.values():
+            while node and id(node) not in busy:
+                busy.add(id(node))
+                node = node.parent
+        # Children of the root hold the statistics the move is chosen from, solved nodes their proofs
+        candidates = [node for node in nodes if node.parent is not None and node.parent is not self.root
+                      and not node.proven and id(node) not in busy]
+        candidates.sort(key=lambda node: node.visits)
+        self.prune_passes += 1
+        for node in candidates:
+            if self.tree_size <= target:
+                break
+            # Skip nodes inside a subtree that is already gone
+            ancestor = node.parent
+            while ancestor is not None and ancestor is not self.root:
+                ancestor = ancestor.parent
+            if ancestor is None:
+                continue
+            parent = node.parent
+            parent.children.remove(node)
+            parent.unexplored_actions.insert(0, node.action)
+            node.parent = None
+            self.tree_size -= sizes[id(node)]
+            self.pruned_nodes += sizes[id(node)]
+
+    def get_leaf_moves(self, node):
+        # Flat cells of the moves from the root down to `node`
+        dim = node.state.shape[1]
+        moves = []
+        while node is not self.root:
+            moves.append(node.action[0] * dim + node.action[1])
+            node = node.parent
+        return moves[::-1]
 
-        print()
-        return self.get_best_action(self.cmp_visits)
-            
     def select(self, node):
         # If the node has no children, expand it
         if not node.children:
@@ -468,13 +887,23 @@ class MCTS:
             if best_node.is_terminal:
                 return best_node, True
             self.expand(best_node)
-            best_node = self.get_best_child(best_node)
+            best_child = self.get_best_child(best_node)
+            if best_child is None: # every child is solved
+                break
+            best_node = best_child
+        # A leaf that has already been simulated from grows its first child, so the tree deepens past the root
+        if not best_node.children and best_node.visits > 0 and not best_node.is_terminal:
+            child = self.expand(best_node)
+            if child is not None:
+                best_node = child
         return best_node , False
     
     def expand(self,node):
         if node.unexplored_actions:
             action = node.unexplored_actions.pop()
             child = node.add_child(action)
+            if self.tree_size is not None:
+                self.tree_size += 1
             return child
         return None
     
@@ -485,6 +914,8 @@ class MCTS:
         for child in node.children:
             if child.is_terminal:
                 return child
+            if child.proven: # solved subtrees need no more simulations
+                continue
             if child.will_opp_win:
                 return child
             if child.visits == 0:
@@ -507,25 +938,13 @@ class MCTS:
         exploration_bias = self.C * math.sqrt(math.log(node.parent.visits)/visits)
         return q_value + exploration_bias + heuristic_bias
     
-    def simulate(self,state,player):
-        current_player = player
-        is_win = False
-        is_terminal = False
-        reward = 0
-        while not is_win and not is_terminal:
-            valid_actions = get_valid_actions(state)
-            if not valid_actions:
-                is_terminal = True
-                break
-            action = random.choice(valid_actions)
-            new_state = self.make_move(state, action, current_player)
-            move_details = check_win(new_state, action, current_player)
-            is_win = move_details[0]
-            if is_win:
-                reward = current_player
-            state = new_state
-            current_player = 3 - current_player
-        return reward
+    def simulate(self,state,player,last_move=None):
+        return policy_playout(state, player, last_move, rng=self.rng, weights=self.playout_weights)
+
+    def simulate_batch(self, state, player, count):
+        # Vectorized playouts of the same leaf, one winner (or 0 for a draw) per playout
+        self.total_simulations += count - 1
+        return get_batch_playout(state.shape[0]).run(state, player, count, rng=self.batch_rng).tolist()
 
     def make_move(self,state,move,player):
         new_state = state.copy()
@@ -542,6 +961,7 @@ class MCTS:
             if reward != node.player:
                 node.wins += 1
 
+            node.update_proven()
             node = node.parent
         
     def get_best_action(self, cmp):
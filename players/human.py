@@ -1,11 +1,24 @@
-import os
 import sys
-import signal
-import select
 import numpy as np
+from queue import Empty
+from threading import Thread
 from typing import Tuple
-from multiprocessing import Value
-from helper import get_valid_actions, fetch_remaining_time, HEXAGON_COORDS, CLICK_EVENT
+from helper import get_valid_actions, fetch_remaining_time, INPUT_EVENTS
+
+
+STDIN_READER = [None]
+
+
+def read_stdin():
+    # Blocks on stdin and forwards every "row, col" line as a move
+    for line in sys.stdin:
+        inp = line.strip()
+        if not inp:
+            continue
+        try:
+            INPUT_EVENTS.put((int(inp.split(',')[0]), int(inp.split(',')[1])))
+        except (ValueError, IndexError):
+            print('Invalid input {}: expected "row, col"'.format(inp))
 
 
 class HumanPlayer:
@@ -21,47 +34,23 @@ class HumanPlayer:
         action = (int(inp[0]), int(inp[1]))
         return action
 
-    def readline_with_timeout(self, move, time_limit):
-        ready, _, _ = select.select([sys.stdin], [], [], time_limit)
-        if ready:
-            inp = sys.stdin.readline().strip()  # Read input if available within the time limit
-            move[0].value = int(inp.split(',')[0])
-            move[1].value = int(inp.split(',')[1])
-        else:
-            move[0].value = self.TLE_MOVE[0]
-            move[1].value = self.TLE_MOVE[1]
+    def get_input(self, time) -> Tuple[int, int]:
+        if STDIN_READER[0] is None:
+            STDIN_READER[0] = Thread(target=read_stdin, daemon=True)
+            STDIN_READER[0].start()
 
-    def readLine(self, move) -> str:    
-        inp = sys.stdin.readline()
-        inp = inp.replace('\n', '')
-        move[0].value = int(inp.split(',')[0])
-        move[1].value = int(inp.split(',')[1])
+        # Drop clicks and lines entered before it was our turn
+        while not INPUT_EVENTS.empty():
+            INPUT_EVENTS.get_nowait()
 
-    def get_input(self, time) -> str:
         print('Enter your move: ')
-        move = (Value('i', -2), Value('i', -2))
-        pid = os.fork()
-        assert pid >= 0
-        if pid == 0:
-            self.readline_with_timeout(move, time)
-            sys.exit()
-        else:
-            while not (CLICK_EVENT[0] or move[0].value >= -1):
-                continue
-
-            try:
-                os.kill(pid, signal.SIGKILL)
-            except:
-                None
-
-            if CLICK_EVENT[0]:
-                polygon_id = CLICK_EVENT[0].widget.find_withtag("current")[0]  # Get the polygon ID
-                move = HEXAGON_COORDS[polygon_id]
-                print(move)
-                CLICK_EVENT[0] = False
-                return move
-
-            return move[0].value, move[1].value
+        try:
+            # Woken by a click or a line on stdin, sleeps otherwise
+            move = INPUT_EVENTS.get(timeout=max(time, 0))
+        except Empty:
+            return self.TLE_MOVE
+        print(move)
+        return move
 
     def get_move(self, state: Tuple[np.array]) -> Tuple[int, int]:
         """
@@ -2,7 +2,7 @@ import random
 import numpy as np
 from time import sleep
 from typing import Tuple
-from helper import get_valid_actions, fetch_remaining_time
+from helper import EmptyCellPool, fetch_remaining_time
 
 
 class RandomPlayer:
@@ -11,6 +11,11 @@ class RandomPlayer:
         self.type = 'random'
         self.player_string = 'Player {}: random'.format(player_number)
         self.timer = timer
+        self.pool = None # cells that were empty on some earlier turn, a superset of the empty cells
+        self.rng = random
+
+    def set_seed(self, seed: int):
+        self.rng = random.Random(seed)
 
     def get_move(self, state: Tuple[np.array]) -> Tuple[int, int]:
         """
@@ -29,6 +34,12 @@ class RandomPlayer:
         Tuple[int, int]: action (coordinates of a board cell)
         """
         sleep(0.01)
-        valid_actions = get_valid_actions(state, self.player_number)
-        action        = random.choice(valid_actions)
-        return int(action[0]), int(action[1])
+        if self.pool is None:
+            self.pool = EmptyCellPool(state)
+        # Cells only ever fill up, so drop the ones found filled since; the first empty one drawn is uniform
+        while len(self.pool):
+            action = self.pool.sample(self.rng)
+            if state[action] == 0:
+                return int(action[0]), int(action[1])
+            self.pool.remove(action)
+        return -1, -1
@@ -0,0 +1,480 @@
+import json
+import random
+import numpy as np
+import multiprocessing as mp
+from functools import lru_cache
+from multiprocessing.connection import wait
+from typing import Dict, List, Tuple
+
+from helper import check_ring, get_cell_tables, get_neighbours, get_all_corners, get_all_edges, may_form_ring, \
+    EmptyCellPool, GroupMap
+
+
+# Probability of playing each pattern's move when the pattern applies, tried in this order
+PATTERN_WEIGHTS = {
+    'win': 1.0,       # complete a bridge or fork
+    'block': 1.0,     # take the cell where the opponent would complete one
+    'bridge': 0.9,    # answer an intrusion into one of our two-bridges
+    'adjacent': 0.3,  # play next to the opponent's last move
+}
+
+
+class BatchPlayout:
+    '''
+    Vectorized random playouts, advancing many copies of a position at once
+
+    Boards are held as a (B, cells) array over the playable cells of the board. Each board draws its move
+    order by sorting random keys over its empty cells, and the players alternate
+    along that order until the board is full. Fork, bridge and ring are all monotone in a player's stones, so
+    instead of checking every ply, the first ply at which each player owns a structure is found by bisecting
+    over its stones, all boards in lock step. Structures are detected with label propagation over the
+    precomputed hex adjacency:
+        - fork / bridge: a connected group touching 3 edges / 2 corners
+        - ring: a group of non-player cells cut off from the border, or a player cell whose 6 neighbours are
+          all the player's (a ring around the player's own stones)
+    '''
+
+    def __init__(self, dim: int):
+        '''
+        # Parameters
+        `dim (int)`: Dimension of the board
+        '''
+        self.dim = dim
+        siz = dim // 2
+        # Playable cells: everything but the cut off corners of the array (blocked cells are handled per board)
+        cells = [(i, j) for j in range(dim) for i in range(dim) if i < dim - abs(j - siz)]
+        index = {cell: k for k, cell in enumerate(cells)}
+        self.size = len(cells)
+        self.cells = np.array([i * dim + j for i, j in cells])
+        sentinel = self.size
+        self.neighbours = np.full((self.size, 6), sentinel)
+        for k, cell in enumerate(cells):
+            adjacent = [index[n] for n in get_neighbours(dim, cell) if n in index]
+            self.neighbours[k, :len(adjacent)] = adjacent
+        degree = (self.neighbours != sentinel).sum(axis=1)
+        self.border = degree < 6
+        self.interior = ~self.border
+        self.corners = np.array([index[cell] for cell in get_all_corners(dim)])
+        self.edges = [np.array([index[cell] for cell in edge]) for edge in get_all_edges(dim)]
+
+    def run(self, board: np.array, player: int, count: int, rng: np.random.Generator = None) -> np.array:
+        '''
+        Plays `count` random games out from `board`, with `player` to move
+
+        # Parameters
+        `board (numpy array)`: Game board
+        `player (int)`: Player to move
+        `count (int)`: Number of playouts
+        `rng (numpy Generator)`: Source of randomness, a fresh unseeded generator if not given
+
+        # Returns
+        np.array: (count,) winners, 1 or 2, or 0 for a board filled without a structure
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        values = board.ravel()[self.cells]
+        empty = np.flatnonzero(values == 0)
+        moves = len(empty)
+        if moves == 0:
+            return np.zeros(count, dtype=int)
+
+        # rank[b, k]: ply at which board b fills its k-th empty cell
+        keys = rng.random((count, moves))
+        rank = np.empty((count, moves), dtype=int)
+        rank[np.arange(count)[:, None], np.argsort(keys, axis=1)] = np.arange(moves)
+
+        # own[side][b, c]: number of stones `side` has placed once cell c is filled by it (0 if already there)
+        never = moves + 1
+        sides = (player, 3 - player)
+        own = np.empty((2 * count, self.size), dtype=int)
+        for side, stone in enumerate(sides):
+            rows = own[side * count:(side + 1) * count]
+            rows[:] = np.where(values == stone, 0, never)
+            mine = rank % 2 == side
+            rows[:, empty] = np.where(mine, rank // 2 + 1, never)
+        totals = np.repeat([(moves + 1) // 2, moves // 2], count)
+
+        # Bisect for the first number of stones at which each side owns a structure
+        lo = np.zeros(2 * count, dtype=int)
+        hi = totals.copy()
+        won = self.has_structure(own <= hi[:, None])
+        active = won & (hi > 1)
+        while active.any():
+            rows = np.flatnonzero(active)
+            mid = (lo[rows] + hi[rows]) // 2
+            found = self.has_structure(own[rows] <= mid[:, None])
+            hi[rows] = np.where(found, mid, hi[rows])
+            lo[rows] = np.where(found, lo[rows], mid)
+            active[rows] = hi[rows] - lo[rows] > 1
+
+        # Stone t of the side to move is ply 2t - 2, of the other side ply 2t - 1
+        plies = np.where(won, 2 * hi - 2 + np.repeat([0, 1], count), never)
+        first, second = plies[:count], plies[count:]
+        return np.where(first < second, sides[0], np.where(second < first, sides[1], 0))
+
+    def components(self, stones: np.array) -> np.array:
+        '''
+        Labels the connected groups of `stones`, a (rows, cells) bool array. Returns (rows, cells + 1) labels:
+        the smallest cell index of the group for stones, `cells` elsewhere (including the sentinel column)
+        '''
+        rows, sentinel = stones.shape[0], self.size
+        labels = np.full((rows, sentinel + 1), sentinel)
+        labels[:, :sentinel] = np.where(stones, np.arange(sentinel), sentinel)
+        while True:
+            smallest = np.minimum(labels[:, :sentinel], labels[:, self.neighbours].min(axis=2))
+            smallest = np.where(stones, smallest, sentinel)
+            # Pointer jumping: follow the label of the label
+            smallest = np.take_along_axis(labels, smallest, axis=1)
+            if np.array_equal(smallest, labels[:, :sentinel]):
+                return labels
+            labels[:, :sentinel] = smallest
+
+    def has_structure(self, stones: np.array) -> np.array:
+        '''
+        Returns whether each row of `stones`, a (rows, cells) bool array, contains a fork, bridge or ring
+        '''
+        rows, sentinel = stones.shape[0], self.size
+        labels = self.components(stones)
+        index = np.arange(rows)[:, None]
+
+        at_corners = labels[:, self.corners]
+        same = (at_corners[:, :, None] == at_corners[:, None, :]) & (at_corners[:, :, None] != sentinel)
+        bridge = np.triu(same, k=1).any(axis=(1, 2))
+
+        touched = np.zeros((rows, sentinel + 1), dtype=np.int8)
+        for edge in self.edges:
+            hit = np.zeros((rows, sentinel + 1), dtype=bool)
+            hit[index, labels[:, edge]] = True
+            touched += hit
+        fork = (touched[:, :sentinel] >= 3).any(axis=1)
+
+        padded = np.zeros((rows, sentinel + 1), dtype=bool)
+        padded[:, :sentinel] = stones
+        filled = (stones & self.interior & padded[:, self.neighbours].all(axis=2)).any(axis=1)
+
+        # Flood the non-player cells from the border, anything left over is enclosed
+        free = ~stones
+        outside = np.zeros((rows, sentinel + 1), dtype=bool)
+        outside[:, :sentinel] = free & self.border
+        while True:
+            spread = free & (outside[:, :sentinel] | outside[:, self.neighbours].any(axis=2))
+            if np.array_equal(spread, outside[:, :sentinel]):
+                break
+            outside[:, :sentinel] = spread
+        enclosed = (free & ~outside[:, :sentinel]).any(axis=1)
+
+        return bridge | fork | filled | enclosed
+
+
+def load_pattern_weights(path: str) -> Dict[str, float]:
+    '''
+    Reads playout pattern weights from a JSON object of pattern name to probability. Patterns missing
+    from the file keep their default weight, and all of them at 0 gives uniformly random playouts
+
+    # Parameters
+    `path (str)`: Path of the JSON file
+
+    # Returns
+    Dict[str, float]: Weight of every pattern of `PATTERN_WEIGHTS`
+    '''
+    with open(path) as file:
+        table = json.load(file)
+    unknown = set(table) - set(PATTERN_WEIGHTS)
+    if unknown:
+        raise ValueError(f'Unknown playout patterns: {sorted(unknown)}')
+    weights = dict(PATTERN_WEIGHTS)
+    weights.update({name: float(weight) for name, weight in table.items()})
+    return weights
+
+
+@lru_cache(maxsize=None)
+def get_bridge_table(dim: int) -> List[List[Tuple[int, int, int]]]:
+    '''
+    Returns the two-bridges through every cell of a `dim` sized board, indexed by flat cell index.
+    A two-bridge joins two cells a and b that are not adjacent but share two (adjacent) neighbours x and y.
+    Entry x lists a (a, b, y) triple for every such bridge, y being the cell that saves it once x is taken
+    '''
+    neighbours, _, _ = get_cell_tables(dim)
+    table = [[] for _ in range(dim * dim)]
+    for a in range(dim * dim):
+        adjacent = set(neighbours[a])
+        for x in neighbours[a]:
+            for b in neighbours[x]:
+                if b <= a or b in adjacent:
+                    continue
+                common = adjacent.intersection(neighbours[b])
+                if len(common) == 2:
+                    y = (common - {x}).pop()
+                    table[x].append((a, b, y))
+    return table
+
+
+class ThreatTracker:
+    '''
+    Empty cells where one more stone of `player` completes a bridge or fork, kept up to date as stones are
+    added. Group corner / edge masks only grow, so a cell stays a threat until it is filled, and only the
+    cells around a group whose masks just grew need to be looked at again
+    '''
+
+    def __init__(self, board: np.array, player: int):
+        '''
+        # Parameters
+        `board (numpy array)`: Game board
+        `player (int)`: Player whose threats are tracked
+        '''
+        self.player = player
+        self.groups = GroupMap(board, player)
+        self.neighbours = self.groups.neighbours
+        self.members = {}  # group id -> cells of the group
+        flat = board.ravel().tolist()
+        for cell, value in enumerate(flat):
+            if value == player:
+                self.members.setdefault(self.groups.find(cell), []).append(cell)
+        self.threats = set()
+        for cell, value in enumerate(flat):
+            if value == 0 and self.completes(cell):
+                self.threats.add(cell)
+
+    def completes(self, cell: int) -> bool:
+        '''
+        Returns whether a stone of the player at the empty `cell` would complete a bridge or fork
+        '''
+        groups = self.groups
+        corners = 1 << groups.corner[cell] if groups.corner[cell] != -1 else 0
+        edges = 1 << groups.edge[cell] if groups.edge[cell] != -1 else 0
+        for neighbour in self.neighbours[cell]:
+            root = groups.find(neighbour)
+            if root != -1:
+                corners |= groups.corners[root]
+                edges |= groups.edges[root]
+        return corners.bit_count() >= 2 or edges.bit_count() >= 3
+
+    def add(self, cell: int, flat: List[int]):
+        '''
+        Adds a stone of the player at `cell`, already marked in `flat`, the flat board as a list
+        '''
+        groups = self.groups
+        pieces = {groups.find(neighbour) for neighbour in self.neighbours[cell]} - {-1}
+        masks = {piece: (groups.corners[piece], groups.edges[piece]) for piece in pieces}
+        root = groups.add_cell(cell)
+        grown = (groups.corners[root], groups.edges[root])
+        recheck = set(self.neighbours[cell])
+        members = [cell]
+        for piece in pieces:
+            cells = self.members.pop(piece)
+            if masks[piece] != grown:
+                for member in cells:
+                    recheck.update(self.neighbours[member])
+            members.extend(cells)
+        self.members[root] = members
+        self.threats.discard(cell)
+        threats = self.threats
+        for other in recheck:
+            if flat[other] == 0 and other not in threats and self.completes(other):
+                threats.add(other)
+
+    def filled(self, cell: int):
+        self.threats.discard(cell)
+
+
+def policy_playout(state: np.array, player: int, last_move: Tuple[int, int] = None, rng=random,
+                   weights: Dict[str, float] = PATTERN_WEIGHTS) -> int:
+    '''
+    Plays one game out from `state` with the pattern policy, `player` to move. Every move tries, in order:
+    completing a bridge or fork, blocking the opponent's, saving a two-bridge the opponent just cut into,
+    and answering next to the opponent's last move, each with its probability from `weights`. Moves that
+    fall through all of them are uniformly random. Bridges and forks are read off the threat trackers,
+    so only rings need a search on the board
+
+    # Parameters
+    `state (numpy array)`: Game board, left untouched
+    `player (int)`: Player to move
+    `last_move (Tuple[int, int])`: The move that led to `state`, if known
+    `rng`: Source of randomness, the `random` module or a `random.Random`
+    `weights (Dict[str, float])`: Probability of each pattern, see `PATTERN_WEIGHTS`
+
+    # Returns
+    int: The winner, or 0 if the board fills up without a structure
+    '''
+    dim = state.shape[0]
+    state = state.copy()
+    board = state.ravel().tolist()
+    neighbours, _, _ = get_cell_tables(dim)
+    bridges = get_bridge_table(dim)
+    pool = EmptyCellPool(state)
+    trackers = {1: ThreatTracker(state, 1), 2: ThreatTracker(state, 2)}
+    last = last_move[0] * dim + last_move[1] if last_move is not None else -1
+    while len(pool):
+        wins, losses = trackers[player].threats, trackers[3 - player].threats
+        cell = -1
+        if wins and rng.random() < weights['win']:
+            cell = next(iter(wins))
+        elif losses and rng.random() < weights['block']:
+            cell = next(iter(losses))
+        elif last != -1:
+            if rng.random() < weights['bridge']:
+                saves = [y for a, b, y in bridges[last] if board[a] == player and board[b] == player and board[y] == 0]
+                if saves:
+                    cell = saves[int(rng.random() * len(saves))]
+            if cell == -1 and rng.random() < weights['adjacent']:
+                free = [neighbour for neighbour in neighbours[last] if board[neighbour] == 0]
+                if free:
+                    cell = free[int(rng.random() * len(free))]
+        if cell == -1:
+            move = pool.sample(rng)
+            cell = move[0] * dim + move[1]
+        else:
+            move = divmod(cell, dim)
+
+        pool.remove(move)
+        state[move] = player
+        board[cell] = player
+        if cell in wins:
+            return player
+        trackers[player].add(cell, board)
+        trackers[3 - player].filled(cell)
+        if may_form_ring(state, move, player) and check_ring(state == player, move):
+            return player
+        last = cell
+        player = 3 - player
+    return 0
+
+
+def playout_worker(conn, seed: int, inherited=()):
+    '''
+    Worker loop of a `PlayoutPool`. Receives the root position once per search, then leaves as the moves
+    played from the root, and answers every leaf with its playout winners. Exits on None or once the pool's
+    end of the pipe is closed
+    '''
+    # Pool ends of the pipes copied in by fork, kept open they would hide the pool going away
+    for other in inherited:
+        other.close()
+    rng = random.Random(seed)
+    batch_rng = np.random.default_rng(seed)
+    root, player, weights = None, None, PATTERN_WEIGHTS
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        if message[0] == 'root':
+            _, root, player, weights = message
+            continue
+        _, token, moves, count = message
+        state = root.copy()
+        flat = state.reshape(-1)
+        mover = player
+        for cell in moves:
+            flat[cell] = mover
+            mover = 3 - mover
+        if count > 1:
+            winners = get_batch_playout(state.shape[0]).run(state, mover, count, batch_rng).tolist()
+        else:
+            last_move = divmod(moves[-1], state.shape[1]) if moves else None
+            winners = [policy_playout(state, mover, last_move, rng, weights)]
+        conn.send((token, winners))
+
+
+class PlayoutPool:
+    '''
+    Persistent pool of playout processes for leaf-parallel MCTS
+
+    The root position is sent to every worker once per search (`set_root`). After that a leaf only
+    travels as the flat cells of the moves leading to it from the root, the players alternating from the
+    root's player to move. Every worker holds at most one leaf at a time, so `idle` tells how many more
+    leaves can be submitted before waiting on results.
+    '''
+
+    def __init__(self, workers: int, seed: int = None):
+        '''
+        # Parameters
+        `workers (int)`: Number of playout processes
+        `seed (int)`: Seed the workers' random streams are derived from, drawn from `random` if not given
+        '''
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.connections = []
+        self.processes = []
+        for k in range(workers):
+            parent_conn, child_conn = mp.Pipe()
+            process = mp.Process(target=playout_worker, args=(child_conn, seed + k, self.connections + [parent_conn]),
+                                 daemon=True)
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+        self.free = list(self.connections)
+        self.busy = set()
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def set_root(self, state: np.array, player: int, weights: Dict[str, float] = PATTERN_WEIGHTS):
+        '''
+        Sends the position leaves are played from and the playout pattern weights, waiting for any result
+        of the previous root first
+        '''
+        self.drain()
+        for conn in self.connections:
+            conn.send(('root', state, player, weights))
+
+    def idle(self) -> int:
+        return len(self.free)
+
+    def pending(self) -> int:
+        return len(self.busy)
+
+    def submit(self, token, moves: List[int], count: int = 1):
+        '''
+        Queues `count` playouts of the leaf reached by `moves` on an idle worker
+
+        # Parameters
+        `token`: Returned along with the results, to match them to the leaf
+        `moves (List[int])`: Flat cells of the moves from the root to the leaf
+        `count (int)`: Number of playouts, run vectorized when above 1
+        '''
+        conn = self.free.pop()
+        conn.send(('leaf', token, moves, count))
+        self.busy.add(conn)
+
+    def collect(self, timeout: float = None) -> List[Tuple[object, List[int]]]:
+        '''
+        Waits up to `timeout` seconds (forever if None) for at least one pending leaf
+
+        # Returns
+        List[Tuple[object, List[int]]]: (token, winners) of every leaf that is done
+        '''
+        if not self.busy:
+            return []
+        results = []
+        for conn in wait(list(self.busy), timeout):
+            results.append(conn.recv())
+            self.busy.discard(conn)
+            self.free.append(conn)
+        return results
+
+    def drain(self) -> List[Tuple[object, List[int]]]:
+        results = []
+        while self.busy:
+            results.extend(self.collect())
+        return results
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=1)
+        self.connections, self.processes, self.free, self.busy = [], [], [], set()
+
+
+@lru_cache(maxsize=None)
+def get_batch_playout(dim: int) -> BatchPlayout:
+    '''
+    Returns the (shared) batch playout engine of a `dim` sized board
+    '''
+    return BatchPlayout(dim)
@@ -0,0 +1,210 @@
+# system libs
+import os
+import json
+import queue
+import random
+import argparse
+import threading
+import multiprocessing as mp
+from typing import Dict, List
+
+# 3rd party lib
+import numpy as np
+
+# Local imports
+from game import get_random_board, get_start_board, make_player, play_game
+
+
+class ShardWriter:
+    '''
+    Background thread that packs self-play positions into fixed size `.npz` shards
+
+    Each shard holds `shard_size` positions (the last one may hold fewer) with the arrays
+        board    (n, D, D) uint8    board before the move
+        to_move  (n,) uint8         player to move, 1 or 2
+        policy   (n, D, D) float32  root visit distribution of the search, one-hot for moves played without search
+        outcome  (n,) int8          final result for the player to move: 1 win, -1 loss, 0 draw
+        game     (n,) int32         index of the game the position comes from
+    and `manifest.json` lists the shards written so far. It is rewritten after every shard, so it always describes
+    complete files even if the run is interrupted.
+    '''
+
+    def __init__(self, out_dir: str, shard_size: int = 4096, config: Dict = None):
+        '''
+        # Parameters
+        `out_dir (str)`: Directory of the shards and the manifest, created if missing
+        `shard_size (int)`: Positions per shard
+        `config (Dict)`: Settings of the run, stored in the manifest
+        '''
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.manifest = {'config': config or {}, 'shard_size': shard_size, 'positions': 0, 'games': 0, 'shards': []}
+        self.queue = queue.Queue()
+        self.buffer: List[Dict[str, np.array]] = []
+        self.buffered = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, records: Dict[str, np.array]):
+        # Records of one game, arrays with the positions along the first axis
+        self.queue.put(records)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            records = self.queue.get()
+            if records is None:
+                break
+            self.buffer.append(records)
+            self.buffered += len(records['to_move'])
+            self.manifest['games'] += 1
+            while self.buffered >= self.shard_size:
+                self.flush(self.shard_size)
+        if self.buffered:
+            self.flush(self.buffered)
+        self.write_manifest()
+
+    def flush(self, size: int):
+        arrays = {key: np.concatenate([records[key] for records in self.buffer]) for key in self.buffer[0]}
+        shard = {key: values[:size] for key, values in arrays.items()}
+        rest = {key: values[size:] for key, values in arrays.items()}
+        self.buffer = [rest] if len(rest['to_move']) else []
+        self.buffered -= size
+
+        name = f'shard_{len(self.manifest["shards"]):05d}.npz'
+        np.savez_compressed(os.path.join(self.out_dir, name), **shard)
+        self.manifest['shards'].append({'file': name, 'positions': size,
+                                        'games': sorted(int(game) for game in np.unique(shard['game']))})
+        self.manifest['positions'] += size
+        self.write_manifest()
+
+    def write_manifest(self):
+        path = os.path.join(self.out_dir, 'manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+def sample_opening(player, plies: int, temperature: float, rng: np.random.Generator):
+    '''
+    Makes `player` draw its moves during the first `plies` plies of the game from the root visit counts of its
+    search raised to 1 / temperature, instead of playing the most visited move, so that games of different seeds
+    part ways early. Positions are still recorded with the full visit distribution
+    '''
+    get_move = player.get_move
+
+    def sampled_move(state: np.array):
+        move = get_move(state)
+        if player.root_visits and np.count_nonzero((state == 1) | (state == 2)) < plies:
+            moves = list(player.root_visits)
+            weights = np.array([player.root_visits[cell] for cell in moves], dtype=np.float64) ** (1 / temperature)
+            choice = moves[rng.choice(len(moves), p=weights / weights.sum())]
+            if choice != move:
+                # The kept subtree belongs to the move the search picked
+                player.tree, player.previous_state = None, None
+                move = choice
+        return move
+
+    player.get_move = sampled_move
+
+
+def play_selfplay_game(spec: Dict) -> Dict[str, np.array]:
+    '''
+    Plays `AIPlayer` against itself in a worker process and records every position
+
+    # Returns
+    Dict[str, np.array]: The arrays of `ShardWriter`, one entry per move played
+    '''
+    board = spec['board']
+    timer = [spec['time'], spec['time']]
+    players = [make_player('ai', 1, timer), make_player('ai', 2, timer)]
+    rng = np.random.default_rng(spec['seed'])
+    for player in players:
+        player.move_time = spec['move_time']
+        if spec['random_plies'] > 0:
+            sample_opening(player, spec['random_plies'], spec['temperature'], rng)
+
+    boards, to_move, policies = [], [], []
+
+    def record(state, player_number, action, player):
+        policy = np.zeros(state.shape, dtype=np.float32)
+        if player.root_visits:
+            for move, visits in player.root_visits.items():
+                policy[move] = visits
+            policy /= policy.sum()
+        else:
+            policy[action] = 1
+        boards.append(state.astype(np.uint8))
+        to_move.append(player_number)
+        policies.append(policy)
+
+    result = play_game('ai', 'ai', board, spec['time'], players=players, on_move=record, seed=spec['seed'])
+    to_move = np.array(to_move, dtype=np.uint8)
+    if result['winner'] == 0:
+        outcome = np.zeros(len(to_move), dtype=np.int8)
+    else:
+        outcome = np.where(to_move == result['winner'], 1, -1).astype(np.int8)
+    size = board.shape[0]
+    return {'board': np.array(boards, dtype=np.uint8).reshape(-1, size, size), 'to_move': to_move,
+            'policy': np.array(policies, dtype=np.float32).reshape(-1, size, size), 'outcome': outcome,
+            'game': np.full(len(to_move), spec['index'], dtype=np.int32)}
+
+
+def game_specs(games: int, dim: int, blocks: int, start_file: str, time: float, move_time: float, random_plies: int,
+               temperature: float, seed: int):
+    rng = random.Random(seed)
+    for index in range(games):
+        board_rng = np.random.RandomState(rng.getrandbits(32))
+        board = get_start_board(start_file) if start_file is not None else get_random_board(dim, blocks, board_rng)
+        yield {'index': index, 'board': board, 'time': time, 'move_time': move_time, 'random_plies': random_plies,
+               'temperature': temperature, 'seed': rng.getrandbits(64)}
+
+
+def run_selfplay(out_dir: str, games: int, dim: int = 4, blocks: int = 0, start_file: str = None, time: float = 60,
+                 move_time: float = 1, parallel: int = None, shard_size: int = 4096, seed: int = None,
+                 random_plies: int = 6, temperature: float = 1) -> Dict:
+    '''
+    Plays `games` self-play games on `parallel` processes, streaming their positions into shards under `out_dir`
+
+    # Returns
+    Dict: The final manifest
+    '''
+    parallel = parallel or mp.cpu_count()
+    seed = random.getrandbits(64) if seed is None else seed
+    config = {'dim': dim, 'blocks': blocks, 'start_file': start_file, 'time': time, 'move_time': move_time,
+              'random_plies': random_plies, 'temperature': temperature, 'seed': seed}
+    writer = ShardWriter(out_dir, shard_size, config)
+    specs = game_specs(games, dim, blocks, start_file, time, move_time, random_plies, temperature, seed)
+    try:
+        with mp.Pool(parallel) as pool:
+            for count, records in enumerate(pool.imap_unordered(play_selfplay_game, specs), 1):
+                writer.put(records)
+                print(f'{count}/{games} games, {len(records["to_move"])} positions', flush=True)
+    finally:
+        writer.close()
+    return writer.manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir', type=str, help='Directory of the shards and manifest.json')
+    parser.add_argument('--games',  type=int, default=100, help='Number of games (int)')
+    parser.add_argument('--time',   type=float, default=60, help='Time budget for each agent per game (float)')
+    parser.add_argument('--move_time', type=float, default=1, help='Search time per move (float)')
+    parser.add_argument('--dim' ,   type=int, default=4,   help='Dimension of the side of the (hexagonal) board (int)')
+    parser.add_argument('--blocks', type=int, default=0,   help='Number of blocked cells in the board (int)')
+    parser.add_argument("--start_file", type=str, default=None, help="Custom initial state of the games specified in havannah/initial_states/<filename>")
+    parser.add_argument('--parallel', type=int, default=None, help='Games played at once, defaults to the number of cores (int)')
+    parser.add_argument('--shard_size', type=int, default=4096, help='Positions per shard (int)')
+    parser.add_argument('--seed',   type=int, default=None, help='Seed of the boards and of the players\' randomness (int)')
+    parser.add_argument('--random_plies', type=int, default=6, help='Opening plies whose moves are drawn from the search\'s visit counts, 0 always plays the best move (int)')
+    parser.add_argument('--temperature', type=float, default=1, help='Visit counts are raised to 1 / temperature when drawing opening moves (float)')
+    args = parser.parse_args()
+    manifest = run_selfplay(args.out_dir, args.games, args.dim, args.blocks, args.start_file, args.time,
+                            args.move_time, args.parallel, args.shard_size, args.seed, args.random_plies,
+                            args.temperature)
+    print(f"{manifest['positions']} positions from {manifest['games']} games in {len(manifest['shards'])} shards")
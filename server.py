@@ -0,0 +1,311 @@
+# system libs
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import multiprocessing as mp
+from typing import Dict, List
+
+# 3rd party lib
+import numpy as np
+
+# Local imports
+from helper import check_win, get_valid_actions
+from game import derive_seeds, get_random_board, get_start_board, INITIAL_STATES_DIR, PLAYER_CLASSES
+
+ENGINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'engine.py')
+
+
+class EngineError(Exception):
+    pass
+
+
+class EngineProcess:
+    '''
+    An `engine.py` subprocess driven over its stdin / stdout from the event loop
+    '''
+
+    def __init__(self, player_name: str):
+        self.player_name = player_name
+        self.process = None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, ENGINE_PATH, self.player_name,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+
+    async def send(self, command: str) -> str:
+        '''
+        Sends one command and waits for its response
+
+        # Returns
+        str: The result of a `=` response. A `?` response raises EngineError with its message
+        '''
+        self.process.stdin.write(command.encode() + b'\n')
+        await self.process.stdin.drain()
+        lines = []
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise EngineError(f'{self.player_name} engine exited')
+            line = line.decode().rstrip('\n')
+            if not line and lines:
+                break
+            if line:
+                lines.append(line)
+        status, _, result = '\n'.join(lines).partition(' ')
+        if status.startswith('?'):
+            raise EngineError(result)
+        return result
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+
+
+class EnginePool:
+    '''
+    Idle engine processes by agent name. Engines are reused across games; one that timed out or failed mid-command
+    is killed instead of being returned
+    '''
+
+    def __init__(self):
+        self.idle: Dict[str, List[EngineProcess]] = {}
+
+    async def acquire(self, player_name: str) -> EngineProcess:
+        idle = self.idle.get(player_name)
+        if idle:
+            return idle.pop()
+        engine = EngineProcess(player_name)
+        await engine.start()
+        return engine
+
+    def release(self, engine: EngineProcess, healthy: bool = True):
+        if healthy and engine.process.returncode is None:
+            self.idle.setdefault(engine.player_name, []).append(engine)
+        else:
+            engine.kill()
+
+    async def close(self):
+        for engines in self.idle.values():
+            for engine in engines:
+                engine.kill()
+                await engine.process.wait()
+        self.idle.clear()
+
+
+def make_board(spec: Dict) -> np.array:
+    if spec.get('start_file') is not None:
+        return get_start_board(spec['start_file'])
+    rng = np.random.RandomState(derive_seeds(spec['seed'])[0] % 2 ** 32)
+    return get_random_board(spec.get('dim', 4), spec.get('blocks', 0), rng)
+
+
+async def run_game(pool: EnginePool, spec: Dict, on_move=None) -> Dict:
+    '''
+    Plays one game between two engines with the rules of `game.Game`: each player has `time` seconds on a
+    monotonic clock, running out of it loses (structure 'time'), its engine dying on a move loses too (structure
+    'forfeit'), and a move outside `get_valid_actions` passes the turn
+
+    # Parameters
+    `pool (EnginePool)`: Engines of both players are taken from and given back to this pool
+    `spec (Dict)`: player1, player2, and optionally dim, blocks, start_file, time and seed
+    `on_move`: Coroutine function called as on_move(player, move, time_left) after every valid move
+
+    # Returns
+    Dict: The `game.play_game` result (winner, structure, moves, time_left), plus the seed used
+    '''
+    board = make_board(spec)
+    time_left = [float(spec.get('time', 240))] * 2
+    result = {'winner': 0, 'structure': None, 'moves': [], 'time_left': time_left, 'seed': spec['seed']}
+    engines = [await pool.acquire(spec['player1']), await pool.acquire(spec['player2'])]
+    healthy = [True, True]
+    try:
+        setup = 'setup ' + ' '.join(str(value) for value in board.ravel())
+        for engine in engines:
+            await engine.send(f"seed {spec['seed']}")
+            await engine.send(setup)
+        turn = 0
+        while get_valid_actions(board):
+            engine, other = engines[turn], engines[1 - turn]
+            await engine.send(f'time_left {turn + 1} {time_left[turn]:.3f}')
+            start = time.monotonic()
+            timed_out = False
+            try:
+                reply = await asyncio.wait_for(engine.send(f'genmove {turn + 1}'), timeout=time_left[turn])
+            except asyncio.TimeoutError:
+                reply, timed_out = None, True
+            except EngineError:
+                # A refused move passes the turn, an engine that died on it loses
+                reply = None if engine.process.stdout.at_eof() else ''
+            except ConnectionError:
+                # The engine was gone before it could be asked for its move
+                reply = None
+            time_left[turn] -= time.monotonic() - start
+            if timed_out or time_left[turn] <= 0:
+                healthy[turn] = False
+                result.update(winner=2 - turn, structure='time')
+                break
+            if reply is None or engine.process.returncode is not None:
+                # Lost with time on the clock: the engine crashed or exited
+                healthy[turn] = False
+                result.update(winner=2 - turn, structure='forfeit')
+                break
+            try:
+                move = tuple(int(value) for value in reply.split(','))
+            except ValueError:
+                move = None
+            if move is not None and move in get_valid_actions(board):
+                board[move] = turn + 1
+                result['moves'].append(move)
+                await other.send(f'play {turn + 1} {move[0]},{move[1]}')
+                if on_move is not None:
+                    await on_move(turn + 1, move, time_left)
+                win, way = check_win(board, move, turn + 1)
+                if win:
+                    result.update(winner=turn + 1, structure=way)
+                    break
+            turn = 1 - turn
+    except (EngineError, ConnectionError) as error:
+        # An engine died outside its own move: no result for this game
+        healthy = [False, False]
+        raise EngineError(str(error))
+    except asyncio.CancelledError:
+        # Cancelled mid-command, the engines may still answer it
+        healthy = [False, False]
+        raise
+    finally:
+        for engine, ok in zip(engines, healthy):
+            pool.release(engine, ok)
+    return result
+
+
+class GameServer:
+    '''
+    Runs many games at once in one event loop, against engine subprocesses, behind a local TCP interface
+
+    Clients send one JSON object per line, each a game to play:
+        {"id": ..., "player1": "ai", "player2": "random", "dim": 4, "blocks": 0, "start_file": null, "time": 240, "seed": 7}
+    Only the players are required, a missing seed is drawn at random. A start_file names a file of the start positions
+    directory (`game.INITIAL_STATES_DIR`). The server answers on the same connection
+    with JSON lines, in the order things happen across all the connection's games:
+        {"event": "queued", "id": ...}
+        {"event": "move", "id": ..., "player": 1, "move": [3, 4], "time_left": [239.1, 240.0]}
+        {"event": "result", "id": ..., "winner": 1, "structure": "bridge", "moves": [...], "time_left": [...], "seed": 7}
+        {"event": "error", "id": ..., "error": "..."}
+    At most `max_games` games run at once, the others wait in turn. Engines stay alive between games.
+    '''
+
+    def __init__(self, max_games: int = None, stream_moves: bool = True):
+        '''
+        # Parameters
+        `max_games (int)`: Games played at once, defaults to the number of cores
+        `stream_moves (bool)`: Send a move event for every move, not only the result
+        '''
+        self.slots = asyncio.Semaphore(max_games or mp.cpu_count())
+        self.stream_moves = stream_moves
+        self.pool = EnginePool()
+        self.next_id = 0
+
+    def check_spec(self, spec: Dict) -> Dict:
+        if not isinstance(spec, dict):
+            raise ValueError('a game is a JSON object')
+        for key in ('player1', 'player2'):
+            if spec.get(key) not in PLAYER_CLASSES or spec.get(key) == 'human':
+                raise ValueError(f'{key} must be one of {[name for name in PLAYER_CLASSES if name != "human"]}')
+        # JSON true / false would pass as the integers 1 / 0
+        for key, low in (('seed', 0), ('dim', 2), ('blocks', 0)):
+            value = spec.get(key)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < low):
+                raise ValueError(f'{key} must be an integer of at least {low}')
+        value = spec.get('time')
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or not 0 < value < float('inf')):
+            raise ValueError('time must be a positive number of seconds')
+        start_file = spec.get('start_file')
+        if start_file is not None:
+            # Only a file of the start positions directory, never a path of the client's choosing
+            if (not isinstance(start_file, str) or os.path.basename(start_file) != start_file
+                    or not os.path.isfile(os.path.join(INITIAL_STATES_DIR, start_file))):
+                raise ValueError(f'start_file must be the name of a file in {INITIAL_STATES_DIR}')
+        spec = dict(spec)
+        if spec.get('id') is None:
+            spec['id'] = self.next_id
+            self.next_id += 1
+        if spec.get('seed') is None:
+            spec['seed'] = random.getrandbits(63)
+        return spec
+
+    async def play(self, spec: Dict, send):
+        async def on_move(player, move, time_left):
+            await send({'event': 'move', 'id': spec['id'], 'player': player, 'move': move, 'time_left': time_left})
+
+        async with self.slots:
+            try:
+                result = await run_game(self.pool, spec, on_move if self.stream_moves else None)
+            except EngineError as error:
+                await send({'event': 'error', 'id': spec['id'], 'error': str(error)})
+                return
+            except Exception as error:
+                # Anything else would vanish in the client's gather and leave the game without an answer
+                await send({'event': 'error', 'id': spec['id'], 'error': f'{type(error).__name__}: {error}'})
+                return
+        await send({'event': 'result', 'id': spec['id'], 'player1': spec['player1'], 'player2': spec['player2'],
+                    **result})
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+
+        games = set()
+
+        async def send(message: Dict):
+            async with lock:
+                try:
+                    writer.write((json.dumps(message) + '\n').encode())
+                    await writer.drain()
+                except ConnectionError:
+                    # The client is gone, nobody is waiting for its games any more
+                    for game in games:
+                        game.cancel()
+
+        try:
+            async for line in reader:
+                if not line.strip():
+                    continue
+                try:
+                    spec = self.check_spec(json.loads(line))
+                except ValueError as error:
+                    await send({'event': 'error', 'id': None, 'error': str(error)})
+                    continue
+                await send({'event': 'queued', 'id': spec['id']})
+                games.add(asyncio.create_task(self.play(spec, send)))
+            # The client is done sending, finish its games before closing
+            await asyncio.gather(*games, return_exceptions=True)
+        except ConnectionError:
+            for game in games:
+                game.cancel()
+        finally:
+            writer.close()
+
+    async def serve(self, port: int):
+        server = await asyncio.start_server(self.handle_client, '127.0.0.1', port)
+        print(f'Game server listening on 127.0.0.1:{server.sockets[0].getsockname()[1]}', file=sys.stderr, flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.pool.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=5100, help='Localhost TCP port to listen on (int)')
+    parser.add_argument('--max_games', type=int, default=None, help='Games played at once, defaults to the number of cores (int)')
+    parser.add_argument('--results_only', action='store_true', help='Do not stream move events, only results')
+    args = parser.parse_args()
+    try:
+        asyncio.run(GameServer(args.max_games, not args.results_only).serve(args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,192 @@
+import time
+import numpy as np
+from typing import List, Tuple, Union
+
+from helper import check_win, may_win
+from symmetry import get_zobrist_keys
+
+
+INF = 10 ** 9
+SIDE_KEY = 0x9E3779B97F4A7C15  # xor-ed into the hash when player 2 is to move
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class ProofNumberSolver:
+    '''
+    Depth-first proof-number search for late endgames
+
+    The solver proves or disproves that `player` wins from a position. Nodes where `player` is to move
+    are OR nodes, the others AND nodes. A draw (board filled without a structure) counts as a disproof.
+    Positions are stored in a transposition table keyed by an incremental Zobrist hash, so the table can
+    be kept across the moves of a game as long as `player` stays the same.
+    '''
+
+    def __init__(self, player: int, node_limit: int = 100000, table_limit: int = 1000000):
+        '''
+        # Parameters
+        `player (int)`: Player to prove a win for
+        `node_limit (int)`: Maximum number of nodes searched per call to `solve`
+        `table_limit (int)`: The transposition table is cleared once it holds more entries than this
+        '''
+        self.player = player
+        self.opponent = 3 - player
+        self.node_limit = node_limit
+        self.table_limit = table_limit
+        self.table = {}  # key -> [pn, dn]
+        self.moves = {}  # key -> (result, moves), see `generate`
+        self.nodes = 0
+        self.deadline = None
+        self.state = None
+        self.keys = None
+        self.effort = {}
+
+    def solve(self, state: np.array, deadline: float = None) -> Tuple[Union[bool, None], Union[Tuple[int, int], None]]:
+        '''
+        Solves the position for `player`, who must be the one to move
+
+        # Parameters
+        `state (numpy array)`: Game board
+        `deadline (float)`: `time.time()` value at which the search gives up
+
+        # Returns
+        Tuple[Union[bool, None], Tuple[int, int]]:
+            - (True, move) if the position is a proven win, `move` being a winning move
+            - (False, move) if it is a proven loss, `move` being the move that took the longest to refute
+            - (None, None) if the node budget or the deadline ran out first
+        '''
+        dim = state.shape[0]
+        if len(self.table) > self.table_limit:
+            self.table.clear()
+            self.moves.clear()
+        self.state = state.copy()
+        self.keys = get_zobrist_keys(dim)
+        self.nodes = 0
+        self.deadline = deadline
+        self.effort = {}
+
+        key = 0
+        for cell, value in enumerate(self.state.ravel().tolist()):
+            key ^= self.keys[cell][value]
+
+        try:
+            pn, dn = self.mid(key, self.player, INF, INF, root=True)
+        except SearchAborted:
+            return None, None
+
+        result, moves = self.moves[key ^ self.side(self.player)]
+        if result is not None:
+            return result, self.to_move(moves[0][0], dim) if moves else None
+        if pn == 0:
+            for move, child in moves:
+                if self.lookup(child, self.opponent)[0] == 0:
+                    return True, self.to_move(move, dim)
+        if dn == 0:
+            move = max(moves, key=lambda entry: self.effort.get(entry[1], 0))[0]
+            return False, self.to_move(move, dim)
+        return None, None
+
+    @staticmethod
+    def side(mover: int) -> int:
+        return SIDE_KEY if mover == 2 else 0
+
+    @staticmethod
+    def to_move(cell: int, dim: int) -> Tuple[int, int]:
+        return divmod(cell, dim)
+
+    def lookup(self, key: int, mover: int) -> List[int]:
+        return self.table.get(key ^ self.side(mover), [1, 1])
+
+    def generate(self, key: int, mover: int) -> Tuple[Union[bool, None], List[Tuple[int, int]]]:
+        '''
+        Returns the outcome of the position if it is decided within one move, else the moves to search
+
+        # Returns
+        Tuple[Union[bool, None], List[Tuple[int, int]]]:
+            - result: True / False if `player` has won / cannot win, None otherwise
+            - moves: (cell, child key) pairs. If the result is decided, holds the deciding move if there is one
+        '''
+        entry = self.moves.get(key ^ self.side(mover))
+        if entry is not None:
+            return entry
+
+        state = self.state
+        dim = state.shape[0]
+        other = 3 - mover
+        empty = np.flatnonzero(state.ravel() == 0).tolist()
+        if not empty:
+            entry = (False, [])
+        else:
+            entry = None
+            threats = []
+            for cell in empty:
+                move = divmod(cell, dim)
+                state[move] = mover
+                win = may_win(state, move, mover) and check_win(state, move, mover)[0]
+                state[move] = other
+                threat = not win and may_win(state, move, other) and check_win(state, move, other)[0]
+                state[move] = 0
+                if win:
+                    entry = (mover == self.player, [(cell, key ^ self.keys[cell][0] ^ self.keys[cell][mover])])
+                    break
+                if threat:
+                    threats.append(cell)
+            if entry is None:
+                # The opponent wins next move unless one of its threats is blocked
+                candidates = threats if threats else empty
+                entry = (None, [(cell, key ^ self.keys[cell][0] ^ self.keys[cell][mover]) for cell in candidates])
+        self.moves[key ^ self.side(mover)] = entry
+        return entry
+
+    def mid(self, key: int, mover: int, thpn: int, thdn: int, root: bool = False) -> Tuple[int, int]:
+        self.nodes += 1
+        if self.nodes > self.node_limit or (self.deadline is not None and self.nodes % 64 == 0 and time.time() > self.deadline):
+            raise SearchAborted()
+
+        result, moves = self.generate(key, mover)
+        if result is not None:
+            values = [0, INF] if result else [INF, 0]
+            self.table[key ^ self.side(mover)] = values
+            return tuple(values)
+
+        is_or = mover == self.player
+        other = 3 - mover
+        dim = self.state.shape[0]
+        while True:
+            children = [self.lookup(child, other) for _, child in moves]
+            if is_or:
+                pn = min(child[0] for child in children)
+                dn = min(INF, sum(child[1] for child in children))
+            else:
+                pn = min(INF, sum(child[0] for child in children))
+                dn = min(child[1] for child in children)
+            if pn >= thpn or dn >= thdn:
+                break
+
+            # Select the most proving child, and the second best value to bound its thresholds
+            index = 0 if is_or else 1
+            order = sorted(range(len(children)), key=lambda k: children[k][index])
+            best = order[0]
+            second = children[order[1]][index] if len(order) > 1 else INF
+            if is_or:
+                child_thpn = min(thpn, second + 1)
+                child_thdn = min(INF, thdn - dn + children[best][1])
+            else:
+                child_thpn = min(INF, thpn - pn + children[best][0])
+                child_thdn = min(thdn, second + 1)
+
+            cell, child = moves[best]
+            move = divmod(cell, dim)
+            self.state[move] = mover
+            before = self.nodes
+            try:
+                self.mid(child, other, child_thpn, child_thdn)
+            finally:
+                self.state[move] = 0
+                if root:
+                    self.effort[child] = self.effort.get(child, 0) + self.nodes - before
+
+        self.table[key ^ self.side(mover)] = [pn, dn]
+        return pn, dn
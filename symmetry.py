@@ -0,0 +1,217 @@
+import numpy as np
+from functools import lru_cache
+from typing import List, Tuple
+
+
+NUM_SYMMETRIES = 12  # 6 rotations x (identity, reflection)
+
+
+def to_cube(vertex: Tuple[int, int], dim: int) -> Tuple[int, int, int]:
+    '''
+    Returns the cube coordinates of a board cell, centred on the middle of the board
+
+    # Parameters
+    vertex (Tuple[int, int]): Coordinates of the cell
+    dim (int): Dimension of the board
+
+    # Returns
+    Tuple[int, int, int]: Cube coordinates (q, r, s) of the cell, with q + r + s == 0
+    '''
+    i, j = vertex
+    siz = dim // 2
+    q = j - siz
+    r = i - min(q, 0) - siz
+    return q, r, -q - r
+
+
+def from_cube(cube: Tuple[int, int, int], dim: int) -> Tuple[int, int]:
+    '''
+    Returns the board cell at the given cube coordinates
+
+    # Parameters
+    cube (Tuple[int, int, int]): Cube coordinates (q, r, s) of the cell
+    dim (int): Dimension of the board
+
+    # Returns
+    Tuple[int, int]: Coordinates of the cell
+    '''
+    q, r, _ = cube
+    siz = dim // 2
+    return r + siz + min(q, 0), q + siz
+
+
+def apply_symmetry(cube: Tuple[int, int, int], sym: int) -> Tuple[int, int, int]:
+    '''
+    Applies one of the 12 board symmetries to a cell given in cube coordinates
+
+    # Parameters
+    cube (Tuple[int, int, int]): Cube coordinates (q, r, s) of the cell
+    sym (int): A number from 0 to 11. sym // 6 selects the reflection, sym % 6 the number of 60 degree rotations
+
+    # Returns
+    Tuple[int, int, int]: Cube coordinates of the transformed cell
+    '''
+    q, r, s = cube
+    if sym // 6:
+        r, s = s, r
+    for _ in range(sym % 6):
+        q, r, s = -r, -s, -q
+    return q, r, s
+
+
+@lru_cache(maxsize=None)
+def get_symmetry_tables(dim: int) -> Tuple[np.array, np.array]:
+    '''
+    Returns the index permutation tables of all the symmetries of a `dim` sized board
+
+    # Parameters
+    dim (int): Dimension of the board
+
+    # Returns
+    Tuple[np.array, np.array]: Two (12, dim * dim) arrays of flat indices
+        - gather[k] maps every cell of the transformed board to the cell it is read from, i.e.
+          `board.ravel()[gather[k]]` is the board transformed by symmetry k
+        - scatter[k] maps every cell to where symmetry k sends it (the inverse of gather[k])
+        - cells that are not part of the board are left in place by every symmetry
+    '''
+    siz = dim // 2
+    identity = np.arange(dim * dim)
+    gather = np.tile(identity, (NUM_SYMMETRIES, 1))
+    scatter = np.tile(identity, (NUM_SYMMETRIES, 1))
+    for i in range(dim):
+        for j in range(dim):
+            if max(map(abs, to_cube((i, j), dim))) > siz:
+                continue
+            for sym in range(NUM_SYMMETRIES):
+                ti, tj = from_cube(apply_symmetry(to_cube((i, j), dim), sym), dim)
+                scatter[sym, i * dim + j] = ti * dim + tj
+                gather[sym, ti * dim + tj] = i * dim + j
+    gather.flags.writeable = False
+    scatter.flags.writeable = False
+    return gather, scatter
+
+
+@lru_cache(maxsize=None)
+def get_zobrist_table(dim: int) -> np.array:
+    '''
+    Returns the Zobrist keys of a `dim` sized board. The keys are drawn from a fixed seed, so
+    hashes are stable across processes and runs
+
+    # Parameters
+    dim (int): Dimension of the board
+
+    # Returns
+    np.array: (dim * dim, 4) array of uint64 keys, one per cell and cell value
+    '''
+    rng = np.random.default_rng(dim)
+    table = rng.integers(0, np.iinfo(np.uint64).max, size=(dim * dim, 4), dtype=np.uint64, endpoint=True)
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=None)
+def get_zobrist_keys(dim: int) -> List[List[int]]:
+    '''
+    Returns the Zobrist keys of a `dim` sized board as Python ints, for hashes updated one move at a time.
+    `keys[cell][value]` is xor-ed in for a cell (flat index) holding `value`
+    '''
+    return get_zobrist_table(dim).tolist()
+
+
+def board_hash(board: np.array) -> int:
+    '''
+    Returns the Zobrist hash of the board
+
+    # Parameters
+    board (numpy array): Game board
+
+    # Returns
+    int: 64 bit hash of the board
+    '''
+    dim = board.shape[0]
+    flat = board.ravel().astype(np.intp)
+    keys = get_zobrist_table(dim)[np.arange(dim * dim), flat]
+    return int(np.bitwise_xor.reduce(keys))
+
+
+def preserved_symmetries(board: np.array) -> np.array:
+    '''
+    Returns the symmetries that map the blocked cells of the board onto themselves
+
+    # Parameters
+    board (numpy array): Game board, blocked cells are marked as 3
+
+    # Returns
+    np.array: Indices of the preserved symmetries, always including 0 (the identity)
+    '''
+    gather, _ = get_symmetry_tables(board.shape[0])
+    blocked = board.ravel() == 3
+    return np.flatnonzero((blocked[gather] == blocked).all(axis=1))
+
+
+def canonicalize(board: np.array, symmetries: np.array = None) -> Tuple[np.array, int]:
+    '''
+    Returns the canonical form of the board, the lexicographically smallest of its symmetric images
+
+    # Parameters
+    board (numpy array): Game board
+    symmetries (numpy array): Symmetries to consider, defaults to the ones preserved by the blocked cells.
+        Pass the result of `preserved_symmetries` when canonicalizing many boards with the same layout
+
+    # Returns
+    Tuple[np.array, int]: Canonical board and the symmetry that maps `board` onto it
+    '''
+    if symmetries is None:
+        symmetries = preserved_symmetries(board)
+    gather, _ = get_symmetry_tables(board.shape[0])
+    images = board.ravel()[gather[symmetries]]
+    best = np.lexsort(images.T[::-1])[0]
+    return images[best].reshape(board.shape), int(symmetries[best])
+
+
+def canonical_hash(board: np.array, symmetries: np.array = None) -> int:
+    '''
+    Returns a hash of the board that is shared by all of its symmetric images
+
+    # Parameters
+    board (numpy array): Game board
+    symmetries (numpy array): Symmetries to consider, see `canonicalize`
+
+    # Returns
+    int: 64 bit Zobrist hash of the canonical board
+    '''
+    canonical, _ = canonicalize(board, symmetries)
+    return board_hash(canonical)
+
+
+def transform_move(move: Tuple[int, int], sym: int, dim: int) -> Tuple[int, int]:
+    '''
+    Maps a move on the board to the matching move on its image under symmetry `sym`
+
+    # Parameters
+    move (Tuple[int, int]): Coordinates of the move
+    sym (int): Symmetry, as returned by `canonicalize`
+    dim (int): Dimension of the board
+
+    # Returns
+    Tuple[int, int]: Coordinates of the move on the transformed board
+    '''
+    _, scatter = get_symmetry_tables(dim)
+    return divmod(int(scatter[sym, move[0] * dim + move[1]]), dim)
+
+
+def inverse_transform_move(move: Tuple[int, int], sym: int, dim: int) -> Tuple[int, int]:
+    '''
+    Maps a move on the image of a board under symmetry `sym` back to the original board.
+    Use this to translate moves stored against a canonical board
+
+    # Parameters
+    move (Tuple[int, int]): Coordinates of the move on the transformed board
+    sym (int): Symmetry, as returned by `canonicalize`
+    dim (int): Dimension of the board
+
+    # Returns
+    Tuple[int, int]: Coordinates of the move on the original board
+    '''
+    gather, _ = get_symmetry_tables(dim)
+    return divmod(int(gather[sym, move[0] * dim + move[1]]), dim)
@@ -0,0 +1,338 @@
+# system libs
+import os
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import asyncio
+import argparse
+import itertools
+from typing import Dict, List
+
+# Local imports
+from game import INITIAL_STATES_DIR, PLAYER_CLASSES
+from server import EngineError, EnginePool, run_game
+
+
+# Job protocol, one JSON object per line over TCP:
+#     worker -> coordinator   {"type": "hello", "name": ..., "slots": 2}
+#     coordinator -> worker   {"type": "job", "job": {"id": 12, "player1": ..., "player2": ..., "dim": ..., "blocks": ...,
+#                                                     "start_file": ..., "time": ..., "seed": ...}}
+#     worker -> coordinator   {"type": "result", "id": 12, "result": {...}, "seconds": 41.2}
+#     worker -> coordinator   {"type": "failed", "id": 12, "error": "..."}
+#     worker -> coordinator   {"type": "heartbeat"}
+#     coordinator -> worker   {"type": "done"}
+# A worker is sent at most `slots` jobs at a time. Results are the records of `server.run_game`.
+
+
+def fingerprint(jobs: List[Dict]) -> str:
+    # Identifies a tournament by all of its game specs, stored with every result to guard resumed runs
+    return hashlib.sha256(json.dumps(jobs, sort_keys=True).encode()).hexdigest()[:16]
+
+
+async def send_message(writer: asyncio.StreamWriter, message: Dict):
+    writer.write((json.dumps(message) + '\n').encode())
+    await writer.drain()
+
+
+async def run_worker(host: str, port: int, slots: int = 1, name: str = None, heartbeat: float = 5):
+    '''
+    Connects to a coordinator and plays the games it hands out on engine subprocesses until it is done
+
+    # Parameters
+    `host (str)`, `port (int)`: Address of the coordinator
+    `slots (int)`: Games played at once, about one per free core
+    `name (str)`: Name reported in the results, defaults to host name and process id
+    `heartbeat (float)`: Seconds between heartbeats
+    '''
+    name = name or f'{socket.gethostname()}:{os.getpid()}'
+    reader, writer = await asyncio.open_connection(host, port)
+    pool = EnginePool()
+    lock = asyncio.Lock()
+
+    async def send(message: Dict):
+        async with lock:
+            await send_message(writer, message)
+
+    async def play(job: Dict):
+        start = time.monotonic()
+        try:
+            result = await run_game(pool, job)
+        except EngineError as error:
+            await send({'type': 'failed', 'id': job['id'], 'error': str(error)})
+            return
+        except Exception as error:
+            # A job this worker cannot play (a start file it lacks, a bad field) must still be answered
+            await send({'type': 'failed', 'id': job['id'], 'error': f'{type(error).__name__}: {error}'})
+            return
+        await send({'type': 'result', 'id': job['id'], 'result': result, 'seconds': time.monotonic() - start})
+
+    async def beat():
+        while True:
+            await asyncio.sleep(heartbeat)
+            await send({'type': 'heartbeat'})
+
+    await send({'type': 'hello', 'name': name, 'slots': slots})
+    games = set()
+    beats = asyncio.create_task(beat())
+    try:
+        async for line in reader:
+            message = json.loads(line)
+            if message['type'] == 'job':
+                game = asyncio.create_task(play(message['job']))
+                games.add(game)
+                game.add_done_callback(games.discard)
+            elif message['type'] == 'done':
+                break
+        await asyncio.gather(*games)
+    finally:
+        beats.cancel()
+        for game in games:
+            game.cancel()
+        writer.close()
+        await pool.close()
+
+
+class WorkerState:
+    def __init__(self, name: str, slots: int, writer: asyncio.StreamWriter):
+        self.name = name
+        self.slots = slots
+        self.writer = writer
+        self.jobs: Dict[int, float] = {}  # id -> time.monotonic() it was sent at
+        self.speed = 1.0  # measured game duration over the expected one, averaged; below 1 is faster than usual
+
+
+class Coordinator:
+    '''
+    Hands game specs out to workers and gathers their results
+
+    Workers pull: each is kept at `slots` games in flight. Expected game durations are measured per kind of game
+    (players, board size and blocks) as results come in, and so is each worker's speed relative to them. Free
+    slots of the fastest workers are filled first and get the longest games waiting, slower workers get the
+    shortest ones, so the last games do not trail on a slow machine. The games of a worker that disconnects or
+    stops sending heartbeats are handed out again, up to `retries` times each.
+    '''
+
+    def __init__(self, jobs: List[Dict], out_path: str, retries: int = 3, timeout: float = 60):
+        '''
+        # Parameters
+        `jobs (List[Dict])`: Game specs with distinct ids
+        `out_path (str)`: JSON lines file the results are appended to. Games already in it are not played again,
+        and a file holding the results of other jobs raises ValueError
+        `retries (int)`: Times a game is handed out again after its worker was lost or it failed
+        `timeout (float)`: Seconds without any message after which a worker is considered lost
+        '''
+        self.out_path = out_path
+        self.retries = retries
+        self.timeout = timeout
+        self.fingerprint = fingerprint(jobs)
+        finished = set()
+        if os.path.exists(out_path):
+            with open(out_path) as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            if any(record.get('tournament') != self.fingerprint for record in records):
+                raise ValueError(f'{out_path} holds results of another tournament (other players, games, board or '
+                                 f'seed), resume with the same settings or choose another --out')
+            finished = {record['id'] for record in records}
+        self.jobs = {job['id']: job for job in jobs}
+        self.waiting = [job['id'] for job in jobs if job['id'] not in finished]
+        self.remaining = len(self.waiting)
+        self.attempts = {job_id: 0 for job_id in self.waiting}
+        self.durations: Dict[str, float] = {}
+        self.workers: Dict[str, WorkerState] = {}
+        self.results: List[Dict] = []
+        self.failed: List[int] = []
+        self.all_done = asyncio.Event()
+        if self.remaining == 0:
+            self.all_done.set()
+
+    @staticmethod
+    def kind(job: Dict) -> str:
+        return f"{job['player1']}|{job['player2']}|{job.get('dim')}|{job.get('blocks')}|{job.get('start_file')}"
+
+    def expected(self, job_id: int) -> float:
+        job = self.jobs[job_id]
+        if self.durations:
+            return self.durations.get(self.kind(job), sum(self.durations.values()) / len(self.durations))
+        return job.get('time', 240)
+
+    async def dispatch(self):
+        for worker in sorted(self.workers.values(), key=lambda worker: worker.speed):
+            while self.waiting and len(worker.jobs) < worker.slots:
+                self.waiting.sort(key=self.expected)
+                job_id = self.waiting.pop() if worker.speed <= 1 else self.waiting.pop(0)
+                self.attempts[job_id] += 1
+                worker.jobs[job_id] = time.monotonic()
+                try:
+                    await send_message(worker.writer, {'type': 'job', 'job': self.jobs[job_id]})
+                except ConnectionError:
+                    break
+
+    def requeue(self, job_id: int, reason: str):
+        if self.attempts[job_id] > self.retries:
+            print(f'game {job_id} given up after {self.attempts[job_id]} attempts: {reason}', file=sys.stderr)
+            self.failed.append(job_id)
+            self.finish_one()
+        else:
+            self.waiting.append(job_id)
+
+    def finish_one(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.all_done.set()
+
+    def record(self, worker: WorkerState, job_id: int, result: Dict, seconds: float):
+        job = self.jobs[job_id]
+        kind = self.kind(job)
+        expected = self.durations.get(kind)
+        if expected is None:
+            self.durations[kind] = seconds
+        else:
+            worker.speed = 0.8 * worker.speed + 0.2 * seconds / max(expected, 1e-3)
+            self.durations[kind] = 0.8 * expected + 0.2 * seconds
+        record = {'id': job_id, 'tournament': self.fingerprint, 'player1': job['player1'], 'player2': job['player2'], 'dim': job.get('dim'),
+                  'blocks': job.get('blocks'), 'start_file': job.get('start_file'), **result,
+                  'worker': worker.name, 'seconds': seconds}
+        with open(self.out_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.results.append(record)
+        self.finish_one()
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker = None
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), self.timeout))
+            worker = WorkerState(hello['name'], hello['slots'], writer)
+            while worker.name in self.workers:
+                worker.name += "'"
+            self.workers[worker.name] = worker
+            print(f'worker {worker.name} joined with {worker.slots} slots', file=sys.stderr)
+            await self.dispatch()
+            while not self.all_done.is_set():
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not line:
+                    break
+                message = json.loads(line)
+                if message['type'] in ('result', 'failed') and message['id'] in worker.jobs:
+                    del worker.jobs[message['id']]
+                    if message['type'] == 'result':
+                        self.record(worker, message['id'], message['result'], message['seconds'])
+                    else:
+                        self.requeue(message['id'], message['error'])
+                    await self.dispatch()
+            if self.all_done.is_set():
+                await send_message(writer, {'type': 'done'})
+        except (asyncio.TimeoutError, ConnectionError, json.JSONDecodeError, KeyError):
+            pass
+        finally:
+            if worker is not None and self.workers.get(worker.name) is worker:
+                del self.workers[worker.name]
+                if worker.jobs:
+                    print(f'worker {worker.name} lost, handing out {len(worker.jobs)} games again', file=sys.stderr)
+                for job_id in worker.jobs:
+                    self.requeue(job_id, f'worker {worker.name} lost')
+                await self.dispatch()
+            writer.close()
+
+    async def run(self, port: int, local: int = 0, local_slots: int = 1) -> List[Dict]:
+        '''
+        Serves workers on `port` (0 picks a free one) until every game has a result or was given up on
+
+        # Parameters
+        `local (int)`: Worker processes to start on this machine
+        `local_slots (int)`: Slots of each local worker
+        '''
+        server = await asyncio.start_server(self.handle_worker, '0.0.0.0', port)
+        port = server.sockets[0].getsockname()[1]
+        print(f'coordinator listening on port {port}, {self.remaining} games to play', file=sys.stderr)
+        processes = []
+        for _ in range(local):
+            processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), 'worker', '--host', '127.0.0.1', '--port', str(port),
+                '--slots', str(local_slots)))
+        async with server:
+            await self.all_done.wait()
+            # Let the workers still connected read their done message
+            for worker in list(self.workers.values()):
+                try:
+                    await send_message(worker.writer, {'type': 'done'})
+                except ConnectionError:
+                    pass
+        for process in processes:
+            await process.wait()
+        return self.results
+
+
+def make_jobs(players: List[str], games: int, dim: int, blocks: int, start_file: str, time: float, seed: int) -> List[Dict]:
+    # Round robin: `games` games for every pair of players, each pair's games in colour swapped twins on the same board
+    rng = random.Random(seed)
+    jobs = []
+    for a, b in itertools.combinations(players, 2):
+        for k in range(games):
+            if k % 2 == 0:
+                board_seed = rng.getrandbits(63)
+            first, second = (a, b) if k % 2 == 0 else (b, a)
+            jobs.append({'id': len(jobs), 'player1': first, 'player2': second, 'dim': dim, 'blocks': blocks,
+                         'start_file': start_file, 'time': time, 'seed': board_seed})
+    return jobs
+
+
+def standings(results: List[Dict]) -> Dict[str, List[float]]:
+    # Player -> [score, games], a draw (full board) scoring half a point
+    table = {}
+    for record in results:
+        for number, name in ((1, record['player1']), (2, record['player2'])):
+            entry = table.setdefault(name, [0.0, 0])
+            entry[1] += 1
+            entry[0] += 0.5 if record['winner'] == 0 else float(record['winner'] == number)
+    return table
+
+
+if __name__ == '__main__':
+    player_types = [name for name in PLAYER_CLASSES if name != 'human']
+    parser = argparse.ArgumentParser()
+    roles = parser.add_subparsers(dest='role', required=True)
+
+    coordinator = roles.add_parser('coordinator', help='Hand out the games of a round robin and gather the results')
+    coordinator.add_argument('players', nargs='+', choices=player_types)
+    coordinator.add_argument('--out',    type=str, default='tournament.jsonl', help='JSON lines file of the results, resumed if it exists')
+    coordinator.add_argument('--games',  type=int, default=10, help='Games per pair of players (int)')
+    coordinator.add_argument('--time',   type=float, default=240, help='Time budget for each agent per game (float)')
+    coordinator.add_argument('--dim' ,   type=int, default=4,   help='Dimension of the side of the (hexagonal) board (int)')
+    coordinator.add_argument('--blocks', type=int, default=0,   help='Number of blocked cells in the board (int)')
+    coordinator.add_argument("--start_file", type=str, default=None, help="Custom initial state of the games specified in havannah/initial_states/<filename>")
+    coordinator.add_argument('--seed',   type=int, default=0,   help='Seed the games\' seeds are drawn from (int)')
+    coordinator.add_argument('--port',   type=int, default=5200, help='TCP port the workers connect to, 0 picks a free one (int)')
+    coordinator.add_argument('--retries', type=int, default=3,  help='Times a game is handed out again after a lost worker or a failure (int)')
+    coordinator.add_argument('--timeout', type=float, default=60, help='Seconds of silence after which a worker is considered lost (float)')
+    coordinator.add_argument('--local',  type=int, default=0,   help='Worker processes to start on this machine (int)')
+    coordinator.add_argument('--slots',  type=int, default=1,   help='Slots of each local worker (int)')
+
+    worker = roles.add_parser('worker', help='Play the games handed out by a coordinator')
+    worker.add_argument('--host',  type=str, default='127.0.0.1', help='Host of the coordinator')
+    worker.add_argument('--port',  type=int, default=5200, help='Port of the coordinator (int)')
+    worker.add_argument('--slots', type=int, default=os.cpu_count(), help='Games played at once, defaults to the number of cores (int)')
+    worker.add_argument('--name',  type=str, default=None, help='Name of this worker in the results')
+    args = parser.parse_args()
+
+    if args.role == 'worker':
+        asyncio.run(run_worker(args.host, args.port, args.slots, args.name))
+    else:
+        if args.start_file is not None and not os.path.isfile(os.path.join(INITIAL_STATES_DIR, args.start_file)):
+            parser.error(f'no start file {args.start_file} in {INITIAL_STATES_DIR}')
+        jobs = make_jobs(args.players, args.games, args.dim, args.blocks, args.start_file, args.time, args.seed)
+        try:
+            coordinator = Coordinator(jobs, args.out, args.retries, args.timeout)
+        except ValueError as error:
+            parser.error(str(error))
+        results = asyncio.run(coordinator.run(args.port, args.local, args.slots))
+        print(f'{len(results)} games played, {len(coordinator.failed)} given up')
+        table = {}
+        # Nothing is written when every game was given up
+        if os.path.exists(args.out):
+            with open(args.out) as f:
+                table = standings([json.loads(line) for line in f if line.strip()])
+        for name, (score, games) in sorted(table.items(), key=lambda item: -item[1][0] / item[1][1]):
+            print(f'{name:10s} {score:6.1f} / {games}')
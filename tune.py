@@ -0,0 +1,166 @@
+# system libs
+import os
+import json
+import random
+import argparse
+import multiprocessing as mp
+from typing import Dict, List
+
+# 3rd party lib
+import numpy as np
+
+# Local imports
+from game import get_random_board, get_start_board, make_player, play_game
+from players.ai import HEURISTIC_PARAMS, TUNABLE_PARAMS, load_params
+
+
+def play_tuning_pair(spec: Dict) -> float:
+    '''
+    Plays the `plus` parameters against the `minus` parameters twice on the same board, once with each colour
+
+    # Returns
+    float: Score of the `plus` parameters over the two games, in [0, 1]
+    '''
+    score = 0.0
+    for plus_first in (True, False):
+        timer = [spec['time'], spec['time']]
+        players = [make_player('ai', 1, timer), make_player('ai', 2, timer)]
+        order = (spec['plus'], spec['minus']) if plus_first else (spec['minus'], spec['plus'])
+        for player, params in zip(players, order):
+            player.params = params
+            player.move_time = spec['move_time']
+        result = play_game('ai', 'ai', spec['board'], spec['time'], players=players, seed=spec['seed'])
+        if result['winner'] == 0:
+            score += 0.5
+        elif result['winner'] == (1 if plus_first else 2):
+            score += 1
+    return score / 2
+
+
+class SPSA:
+    '''
+    Simultaneous perturbation stochastic approximation over the heuristic parameters of `players/ai.py`
+
+    Every iteration perturbs all the tuned parameters at once by +/- c_k (relative to their starting value),
+    plays the two perturbed sets against each other and moves along the estimated gradient of their score
+    difference with step a_k. The gains follow the usual schedules a_k = a / (k + 1 + A) ** 0.602 and
+    c_k = c / (k + 1) ** 0.101. The state is saved to a JSON checkpoint after each iteration, and a run
+    started on an existing checkpoint continues from its last iteration.
+    '''
+
+    def __init__(self, checkpoint: str, names: List[str] = None, start: Dict[str, float] = None,
+                 a: float = 0.2, c: float = 0.2, A: float = 10, seed: int = None):
+        '''
+        # Parameters
+        `checkpoint (str)`: Path of the JSON checkpoint, loaded if it exists
+        `names (List[str])`: Parameters to tune, all of `TUNABLE_PARAMS` if None
+        `start (Dict[str, float])`: Starting parameters, the defaults if None
+        `a (float)`: Step size, in units of the starting values
+        `c (float)`: Perturbation size, as a fraction of the starting values
+        `A (float)`: Stability constant of the step schedule
+        `seed (int)`: Seed of the perturbations and of the games
+        '''
+        self.checkpoint = checkpoint
+        if os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            self.names, self.scale = state['names'], state['scale']
+            self.a, self.c, self.A, self.seed = state['a'], state['c'], state['A'], state['seed']
+            self.iteration, self.params, self.history = state['iteration'], state['params'], state['history']
+            return
+        start = dict(start or HEURISTIC_PARAMS)
+        self.names = list(names or TUNABLE_PARAMS)
+        unknown = set(self.names) - set(TUNABLE_PARAMS)
+        if unknown:
+            raise ValueError(f'Unknown or untunable heuristic parameters: {sorted(unknown)}')
+        # Tuned in units of the starting value, so one step size suits weights of 1 and of 300 alike
+        self.scale = {name: max(abs(start[name]), 1e-3) for name in self.names}
+        self.a, self.c, self.A = a, c, A
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.iteration = 0
+        self.params = start
+        self.history = []
+
+    def gains(self, k: int):
+        return self.a / (k + 1 + self.A) ** 0.602, self.c / (k + 1) ** 0.101
+
+    def perturbation(self, k: int) -> Dict[str, int]:
+        rng = random.Random(self.seed * 1000003 + k)
+        return {name: rng.choice((-1, 1)) for name in self.names}
+
+    def perturbed(self, delta: Dict[str, int], c_k: float, sign: int) -> Dict[str, float]:
+        params = dict(self.params)
+        for name in self.names:
+            params[name] = max(self.params[name] + sign * c_k * delta[name] * self.scale[name], 0.0)
+        return params
+
+    def step(self, pool, pairs: int, board_fn, time: float, move_time: float) -> float:
+        '''
+        Runs one iteration with `pairs` colour swapped game pairs played on `pool`, on boards drawn by
+        `board_fn(rng)` from a seeded numpy RandomState
+
+        # Returns
+        float: Mean score of the `plus` parameters
+        '''
+        k = self.iteration
+        a_k, c_k = self.gains(k)
+        delta = self.perturbation(k)
+        plus, minus = self.perturbed(delta, c_k, 1), self.perturbed(delta, c_k, -1)
+        rng = random.Random(self.seed * 1000003 + k + 1)
+        specs = []
+        for _ in range(pairs):
+            specs.append({'plus': plus, 'minus': minus, 'board': board_fn(np.random.RandomState(rng.getrandbits(32))),
+                          'time': time, 'move_time': move_time,
+                          'seed': rng.getrandbits(63)})
+        score = sum(pool.imap_unordered(play_tuning_pair, specs)) / pairs
+
+        # The score difference of plus over minus is 2 * score - 1
+        for name in self.names:
+            gradient = (2 * score - 1) / (2 * c_k * delta[name])
+            self.params[name] = max(self.params[name] + a_k * gradient * self.scale[name], 0.0)
+        self.iteration += 1
+        self.history.append({'iteration': self.iteration, 'score': score, 'params': dict(self.params)})
+        self.save()
+        return score
+
+    def save(self):
+        state = {'names': self.names, 'scale': self.scale, 'a': self.a, 'c': self.c, 'A': self.A,
+                 'seed': self.seed, 'iteration': self.iteration, 'params': self.params, 'history': self.history}
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='JSON checkpoint of the run, resumed if it exists')
+    parser.add_argument('--iterations', type=int, default=100, help='Iterations to reach, counting resumed ones (int)')
+    parser.add_argument('--pairs',  type=int, default=8, help='Colour swapped game pairs per iteration (int)')
+    parser.add_argument('--params', type=str, nargs='*', default=None, help='Parameters to tune, all of TUNABLE_PARAMS by default')
+    parser.add_argument('--start',  type=str, default=None, help='JSON file of starting parameters (see load_params)')
+    parser.add_argument('--out',    type=str, default=None, help='Write the current parameters to this JSON file after every iteration')
+    parser.add_argument('--a',      type=float, default=0.2, help='SPSA step size, relative to the starting values (float)')
+    parser.add_argument('--c',      type=float, default=0.2, help='SPSA perturbation size, relative to the starting values (float)')
+    parser.add_argument('--time',   type=float, default=60, help='Time budget for each agent per game (float)')
+    parser.add_argument('--move_time', type=float, default=0.5, help='Search time per move (float)')
+    parser.add_argument('--dim' ,   type=int, default=4,   help='Dimension of the side of the (hexagonal) board (int)')
+    parser.add_argument('--blocks', type=int, default=0,   help='Number of blocked cells in the board (int)')
+    parser.add_argument("--start_file", type=str, default=None, help="Custom initial state of the games specified in havannah/initial_states/<filename>")
+    parser.add_argument('--parallel', type=int, default=None, help='Games played at once, defaults to the number of cores (int)')
+    parser.add_argument('--seed',   type=int, default=None, help='Seed of the perturbations and games of a new run (int)')
+    args = parser.parse_args()
+
+    start = load_params(args.start) if args.start is not None else None
+    tuner = SPSA(args.checkpoint, args.params, start, args.a, args.c, seed=args.seed)
+    if args.start_file is not None:
+        board_fn = lambda rng: get_start_board(args.start_file)
+    else:
+        board_fn = lambda rng: get_random_board(args.dim, args.blocks, rng)
+    with mp.Pool(args.parallel or mp.cpu_count()) as pool:
+        while tuner.iteration < args.iterations:
+            score = tuner.step(pool, args.pairs, board_fn, args.time, args.move_time)
+            print(f'iteration {tuner.iteration}: plus scored {score:.3f}  '
+                  + ' '.join(f'{name}={tuner.params[name]:.3g}' for name in tuner.names), flush=True)
+            if args.out is not None:
+                with open(args.out, 'w') as f:
+                    json.dump({name: tuner.params[name] for name in tuner.names}, f, indent=1)